@@ -0,0 +1,116 @@
+import logging
+import time
+from sqlalchemy import func, select
+from extensions import db, socketio
+from models import TranslationJob
+
+ACCEPT = 'accept'
+DEFER = 'defer'
+REJECT = 'reject'
+
+class Overloaded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Translation service is overloaded, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+class AdmissionControl:
+    # Decides what happens to new translation work from the backlog (requests
+    # waiting in the broker's queues plus pending jobs) and this process's
+    # in-flight RPCs: run it now, defer it to the job sweeper (which sends it
+    # later as low-priority bulk requests), or reject it with a Retry-After.
+    # Keeps the request queue, and so latency for accepted messages, bounded
+    # however hard clients push.
+    def __init__(self, client, app=None):
+        self.client = client
+        self.enabled = False
+        self.depth = 0
+        self.pending = 0
+        self.depth_read_at = None
+        self.refreshing = False
+        self.scheduled = 0
+        self.decisions = {ACCEPT: 0, DEFER: 0, REJECT: 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['ADMISSION_CONTROL']
+        self.queue_defer = app.config['ADMISSION_QUEUE_DEFER']
+        self.queue_reject = app.config['ADMISSION_QUEUE_REJECT']
+        self.in_flight_defer = app.config['ADMISSION_IN_FLIGHT_DEFER']
+        self.in_flight_reject = app.config['ADMISSION_IN_FLIGHT_REJECT']
+        self.refresh_interval = app.config['ADMISSION_REFRESH_INTERVAL']
+        self.retry_after = app.config['ADMISSION_RETRY_AFTER']
+
+    def refresh(self):
+        # Waiting requests over all request queues and pending jobs over all
+        # workers, re-read at most every refresh_interval by one greenlet while
+        # the others use the last values. Needs an app context.
+        now = time.monotonic()
+        stale = self.depth_read_at is None or now - self.depth_read_at >= self.refresh_interval
+        if not stale or self.refreshing:
+            return
+        self.refreshing = True
+        try:
+            if self.client.ready.is_set():
+                self.depth = sum(depth for _, depth, _ in self.client.queue_depths(timeout=1))
+            # Own connection, so the caller's transaction is left alone
+            with db.engine.connect() as connection:
+                self.pending = connection.scalar(
+                    select(func.count(TranslationJob.id)).where(TranslationJob.state == 'pending')
+                )
+        except Exception as error:
+            logging.warning(f"Could not read translation backlog: {error}")
+        finally:
+            self.depth_read_at = now
+            self.refreshing = False
+
+    def in_flight(self):
+        # A burst of requests is admitted before any of its background tasks
+        # has sent an RPC, so work counts from when it was spawned
+        return max(self.client.in_flight, self.scheduled)
+
+    def pressure(self, pending=True):
+        # The decision for new work right now, without counting it. The
+        # sweeper leaves out pending jobs, which are what it is there to drain.
+        if not self.enabled:
+            return ACCEPT
+        self.refresh()
+        depth = self.depth + (self.pending if pending else 0)
+        in_flight = self.in_flight()
+        if depth >= self.queue_reject or in_flight >= self.in_flight_reject:
+            return REJECT
+        if depth >= self.queue_defer or in_flight >= self.in_flight_defer:
+            return DEFER
+        return ACCEPT
+
+    def decide(self):
+        decision = self.pressure()
+        self.decisions[decision] += 1
+        if decision != ACCEPT:
+            logging.debug(
+                f"Admission {decision}: queue depth {self.depth}, pending jobs {self.pending}, "
+                f"in flight {self.in_flight()}"
+            )
+        return decision
+
+    def admit(self):
+        # ACCEPT or DEFER; raises Overloaded instead of REJECT
+        decision = self.decide()
+        if decision == REJECT:
+            raise Overloaded(self.retry_after)
+        return decision
+
+    def spawn(self, func, *args):
+        # socketio.start_background_task for admitted translation work
+        self.scheduled += 1
+
+        def run():
+            try:
+                return func(*args)
+            finally:
+                self.scheduled -= 1
+
+        return socketio.start_background_task(run)
+
+    def stats(self):
+        return {'decisions': dict(self.decisions), 'queue_depth': self.depth, 'pending_jobs': self.pending}
@@ -1,24 +1,53 @@
+import eventlet
+
+# Before any other import: locks and sockets created by the modules below
+# (e.g. the RPC client's) must already be green
+eventlet.monkey_patch()
+
 from flask import Flask
 from flask_restx import Api
 from config import Config
-from extensions import db, ma, migrate, jwt, login_manager, socketio
+import engines
+from extensions import db, ma, migrate, jwt, login_manager, socketio, cpu_pool, message_keyring, metrics
 from models import User, Message, Contact
-from routes import register_routes
-import eventlet
-
-eventlet.monkey_patch()
+from routes import (
+    register_routes, translation_cache, translation_memory, translation_client, profile_cache, translation_jobs,
+    passwords, rate_limiter, admission, message_index
+)
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
     # Initialize extensions
+    engines.configure(app)
     db.init_app(app)
+    engines.init_app(app, db)
     ma.init_app(app)
     migrate.init_app(app, db)
     jwt.init_app(app)
     login_manager.init_app(app)
-    socketio.init_app(app, cors_allowed_origins="*", async_mode='eventlet')
+    cpu_pool.init_app(app)
+    message_keyring.init_app(app)
+    socketio.init_app(
+        app,
+        cors_allowed_origins="*",
+        async_mode='eventlet',
+        message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'] or None,
+        channel=app.config['SOCKETIO_CHANNEL']
+    )
+    translation_cache.init_app(app)
+    translation_memory.init_app(app)
+    profile_cache.init_app(app)
+    translation_jobs.init_app(app)
+    passwords.init_app(app)
+    rate_limiter.init_app(app)
+    admission.init_app(app)
+    message_index.init_app(app)
+    metrics.init_app(
+        app, translation_client, translation_cache, profile_cache, translation_memory, translation_jobs, db,
+        cpu_pool, passwords, rate_limiter, admission
+    )
 
     # Initialize Flask-RESTX
     api = Api(app, version='1.0', title='Translation API', description='meow meow meow => hi hello world')
@@ -33,4 +62,5 @@ app = create_app()
 if __name__ == '__main__':
     print("Starting the Flask application")
     print("App listening on port 5001")
+    translation_jobs.start_sweeper(app)
     socketio.run(app, host='0.0.0.0', port=5001)
\ No newline at end of file
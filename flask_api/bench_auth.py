@@ -0,0 +1,101 @@
+"""Password hashing cost per method, and how a login storm stalls the hub.
+
+    python bench_auth.py --methods pbkdf2:sha256:100000,pbkdf2:sha256:260000 --logins 16
+
+For every method it reports the time to hash and verify one password, then
+runs --logins concurrent verifications inline and through CpuPool while a
+heartbeat greenlet ticks every millisecond. The worst heartbeat gap is how
+long every socket on the worker went unserved; the credential cache row
+shows a repeated login. PASSWORD_HASH_METHOD picks the method.
+"""
+import eventlet
+
+eventlet.monkey_patch()
+
+import argparse
+import json
+import time
+import types
+from werkzeug.security import generate_password_hash, check_password_hash
+from offload import CpuPool
+from passwords import PasswordHasher
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def heartbeat(gaps, stop):
+    last = time.perf_counter()
+    while not stop:
+        eventlet.sleep(0.001)
+        now = time.perf_counter()
+        gaps.append(now - last)
+        last = now
+
+def storm(verify, logins):
+    gaps = []
+    stop = []
+    beat = eventlet.spawn(heartbeat, gaps, stop)
+    eventlet.sleep(0.01)
+    start = time.perf_counter()
+    for thread in [eventlet.spawn(verify, index) for index in range(logins)]:
+        thread.wait()
+    elapsed = time.perf_counter() - start
+    stop.append(True)
+    beat.wait()
+    return elapsed, max(gaps) * 1000
+
+def config(method, offload, threads, cache_ttl):
+    return types.SimpleNamespace(config={
+        'CPU_OFFLOAD': offload, 'CPU_OFFLOAD_THREADS': threads, 'CPU_YIELD_EVERY': 64,
+        'PASSWORD_HASH_METHOD': method, 'PASSWORD_SALT_LENGTH': 16,
+        'CREDENTIAL_CACHE_SIZE': 1000, 'CREDENTIAL_CACHE_TTL': cache_ttl
+    })
+
+def run(method, args):
+    password_hash = generate_password_hash('correct horse', method)
+    results = [{
+        'method': method, 'mode': 'single',
+        'hash_ms': round(timed(lambda: generate_password_hash('correct horse', method), args.repeat), 2),
+        'verify_ms': round(timed(lambda: check_password_hash(password_hash, 'correct horse'), args.repeat), 2)
+    }]
+    for mode, offload, cache_ttl in (('inline', False, 0), ('offloaded', True, 0), ('cached', True, 300)):
+        app = config(method, offload, args.threads, cache_ttl)
+        pool = CpuPool(app)
+        passwords = PasswordHasher(pool, app)
+        if cache_ttl:
+            passwords.verify(0, password_hash, 'correct horse')
+        # Every login is user 0 so the cached mode hits after the first one above
+        elapsed, worst_gap = storm(lambda index: passwords.verify(0, password_hash, 'correct horse'), args.logins)
+        results.append({
+            'method': method, 'mode': mode, 'logins': args.logins,
+            'seconds': round(elapsed, 3), 'logins_per_second': round(args.logins / elapsed, 1),
+            'worst_hub_stall_ms': round(worst_gap, 1)
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--methods', default='pbkdf2:sha256:100000,pbkdf2:sha256:260000,pbkdf2:sha256:600000')
+    parser.add_argument('--logins', type=int, default=16, help='concurrent logins per storm')
+    parser.add_argument('--threads', type=int, default=4, help='CPU_OFFLOAD_THREADS')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help='print one JSON object per result')
+    args = parser.parse_args()
+
+    if not args.json:
+        print(f"{'method':<24}{'mode':<11}{'hash ms':>9}{'verify ms':>11}{'logins/s':>10}{'worst stall ms':>16}")
+    for method in args.methods.split(','):
+        for result in run(method, args):
+            if args.json:
+                print(json.dumps(result))
+            elif result['mode'] == 'single':
+                print(f"{method:<24}{'single':<11}{result['hash_ms']:>9}{result['verify_ms']:>11}")
+            else:
+                print(f"{method:<24}{result['mode']:<11}{'':>9}{'':>11}"
+                      f"{result['logins_per_second']:>10}{result['worst_hub_stall_ms']:>16}")
+
+if __name__ == '__main__':
+    main()
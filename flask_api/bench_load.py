@@ -0,0 +1,330 @@
+"""Load test for the Flask app with a stub broker and model.
+
+    python bench_load.py --scenarios post,socket,history,bulk --concurrency 1,8,32 \
+        --requests 200 --first-token-ms 50 --tokens-per-second 40 --output results.json
+
+    python bench_load.py ... --baseline results.json --tolerance 0.2
+
+Runs create_app in-process against SQLite (default, a temp file) or
+--database-url, with translations served by fake_broker's in-process AMQP
+stand-in, or by a stub worker on a local RabbitMQ with --broker rabbitmq.
+
+Scenarios:
+    post     POST /api/messages
+    socket   send_message socket event
+    history  GET /api/messages, latest page of a long conversation
+    bulk     POST /api/messages/bulk with --bulk-size items
+    sync     GET /api/sync for a reconnecting client that missed --sync-missed messages
+    search   GET /api/messages/search for one of the seeded history messages
+
+For every scenario and concurrency level it reports request latency
+percentiles, throughput, end-to-end translation latency (request start to
+message_translated) and per-stage timings (db, encrypt, rpc wait, emit...).
+Requests shed by admission control (429) are counted apart from errors; a
+handful of bench users would only measure the rate limits, so those are off
+unless RATE_LIMIT_ENABLED=true is set. With --baseline, exits non-zero when p95 latency or throughput regress by
+more than --tolerance.
+"""
+import eventlet
+
+eventlet.monkey_patch()
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+def percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def at(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {'count': len(ordered), 'p50': at(0.50), 'p95': at(0.95), 'p99': at(0.99), 'max': at(1.0)}
+
+class Recorder:
+    # Collects timing spans and translation completion times for one run
+    def __init__(self):
+        self.stages = defaultdict(list)
+        self.started = {}
+        self.end_to_end = []
+
+    def __call__(self, name, seconds):
+        self.stages[name].append(seconds)
+
+    def reset(self):
+        self.stages.clear()
+        self.started.clear()
+        self.end_to_end = []
+
+def build_app(args):
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    # Every benchmark message is unique, the cache would only add noise
+    os.environ.setdefault('TRANSLATION_CACHE_SIZE', '1')
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    # Benchmark messages are thrown away with the database
+    os.environ.setdefault('MESSAGE_ENCRYPTION_DEV_KEY', 'true')
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import fake_broker
+    import translation_service
+
+    model_options = {
+        'first_token_ms': args.first_token_ms,
+        'tokens_per_second': args.tokens_per_second,
+        'parallel': args.model_parallel
+    }
+    if args.broker == 'fake':
+        fake_broker.install(**model_options)
+    else:
+        fake_broker.RabbitMQStubWorker(
+            translation_service.Config.RABBITMQ_HOST,
+            translation_service.REQUEST_QUEUE,
+            translation_service.REQUEST_QUEUE_ARGUMENTS,
+            **model_options
+        ).start()
+
+    import app as app_module
+    from extensions import db, socketio
+
+    with app_module.app.app_context():
+        db.create_all()
+    return app_module.app, socketio
+
+def instrument(socketio, recorder):
+    import timing
+
+    timing.add_sink(recorder)
+    original_emit = socketio.emit
+
+    def emit(event, *args, **kwargs):
+        now = time.perf_counter()
+        payload = args[0] if args else None
+        if event == 'receive_message' and isinstance(payload, dict):
+            # Emitted from the greenlet that is serving the request being timed
+            started = getattr(eventlet.getcurrent(), 'bench_started', None)
+            if started is not None:
+                recorder.started[payload['id']] = started
+        elif event == 'message_translated' and isinstance(payload, dict):
+            started = recorder.started.pop(payload['id'], None)
+            if started is not None:
+                recorder.end_to_end.append(now - started)
+        return original_emit(event, *args, **kwargs)
+
+    socketio.emit = emit
+
+def create_users(app, count, language):
+    from models import User
+
+    client = app.test_client()
+    users = []
+    suffix = int(time.time() * 1000)
+    for index in range(count):
+        username = f'bench{suffix}_{index}'
+        response = client.post('/api/users', json={
+            'username': username, 'email': f'{username}@example.com', 'password': 'bench', 'language': language
+        })
+        with app.app_context():
+            user_id = User.query.filter_by(username=username).one().id
+        users.append((user_id, response.get_json()['access_token']))
+    return users
+
+def seed_history(app, sender_id, receiver_id, count):
+    from routes import create_messages
+
+    with app.test_request_context():
+        for start in range(0, count, 1000):
+            items = [{'receiver_id': receiver_id, 'content': f'history {i}'} for i in range(start, min(count, start + 1000))]
+            create_messages(sender_id, items)
+
+def missed_cursor(app, missed):
+    # A sync cursor from before the newest `missed` messages, all of them translated
+    from extensions import db
+    from models import Message, MessageTranslation
+    from pagination import encode_sync_cursor
+    from sqlalchemy import func
+
+    with app.app_context():
+        newest = db.session.query(func.max(Message.id)).scalar() or 0
+        translation = db.session.query(func.max(MessageTranslation.id)).scalar() or 0
+    after = max(0, newest - missed)
+    return encode_sync_cursor(after, translation, after + 1)
+
+def run_level(app, socketio, users, scenario, concurrency, args, counter, sync_cursor=None):
+    pool = eventlet.GreenPool(concurrency)
+    latencies = []
+    errors = [0]
+    shed = [0]
+    socket_clients = {}
+
+    def one(index):
+        (sender_id, token), (receiver_id, _) = users[index % len(users)], users[(index + 1) % len(users)]
+        headers = {'Authorization': f'Bearer {token}'}
+        # Detected as English, so every message needs a model call to reach --language
+        text = f'this is benchmark message {next(counter)} ' + ' '.join(['word'] * args.words)
+        client = app.test_client()
+        eventlet.getcurrent().bench_started = start = time.perf_counter()
+
+        if scenario == 'post':
+            response = client.post('/api/messages', json={'receiver_id': receiver_id, 'content': text}, headers=headers)
+            ok = response.status_code == 201
+            rejected = response.status_code == 429
+        elif scenario == 'bulk':
+            items = [{'receiver_id': receiver_id, 'content': f'{text} {i}'} for i in range(args.bulk_size)]
+            response = client.post('/api/messages/bulk', json={'messages': items}, headers=headers)
+            ok = response.status_code == 201
+            rejected = response.status_code == 429
+        elif scenario == 'history':
+            response = client.get(f'/api/messages?contact_id={users[1][0]}', headers={
+                'Authorization': f'Bearer {users[0][1]}'
+            })
+            ok = response.status_code == 200
+            rejected = False
+        elif scenario == 'sync':
+            response = client.get(f'/api/sync?since={sync_cursor}', headers={
+                'Authorization': f'Bearer {users[1][1]}'
+            })
+            ok = response.status_code == 200
+            rejected = False
+        elif scenario == 'search':
+            response = client.get(f'/api/messages/search?q=history+{index % args.history}', headers={
+                'Authorization': f'Bearer {users[1][1]}'
+            })
+            ok = response.status_code == 200 and len(response.get_json()['messages']) == 1
+            rejected = False
+        else:
+            greenlet = eventlet.getcurrent()
+            sio = socket_clients.get(greenlet)
+            if sio is None:
+                sio = socket_clients[greenlet] = socketio.test_client(app, headers=headers)
+            sio.emit('send_message', {'receiver_id': receiver_id, 'content': text})
+            rejected = any(event['name'] == 'message_rejected' for event in sio.get_received())
+            ok = not rejected
+
+        latencies.append(time.perf_counter() - start)
+        if rejected:
+            shed[0] += 1
+        elif not ok:
+            errors[0] += 1
+
+    started = time.perf_counter()
+    for index in range(args.requests):
+        pool.spawn_n(one, index)
+    pool.waitall()
+    elapsed = time.perf_counter() - started
+
+    for sio in socket_clients.values():
+        sio.disconnect()
+    return latencies, errors[0], shed[0], elapsed
+
+def wait_for_translations(recorder, timeout):
+    deadline = time.perf_counter() + timeout
+    while recorder.started and time.perf_counter() < deadline:
+        eventlet.sleep(0.01)
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as baseline_file:
+        baseline = {(r['scenario'], r['concurrency']): r for r in json.load(baseline_file)['results']}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get((result['scenario'], result['concurrency']))
+        if previous is None:
+            continue
+        if result['latency_ms']['p95'] > previous['latency_ms']['p95'] * (1 + tolerance):
+            regressions.append(f"{result['scenario']}@{result['concurrency']}: p95 "
+                               f"{previous['latency_ms']['p95']}ms -> {result['latency_ms']['p95']}ms")
+        if result['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{result['scenario']}@{result['concurrency']}: throughput "
+                               f"{previous['throughput_rps']} -> {result['throughput_rps']} req/s")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default='post,socket,history,bulk')
+    parser.add_argument('--concurrency', default='1,8,32')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario and concurrency level')
+    parser.add_argument('--words', type=int, default=8, help='extra words per message')
+    parser.add_argument('--bulk-size', type=int, default=50)
+    parser.add_argument('--history', type=int, default=5000, help='messages seeded for the history, sync and search scenarios')
+    parser.add_argument('--sync-missed', type=int, default=20, help='messages a syncing client missed')
+    parser.add_argument('--users', type=int, default=16)
+    parser.add_argument('--language', default='es',
+                        help="users' language; messages are English, so 'en' skips the model entirely")
+    parser.add_argument('--database-url', default='')
+    parser.add_argument('--broker', choices=('fake', 'rabbitmq'), default='fake')
+    parser.add_argument('--first-token-ms', type=float, default=50)
+    parser.add_argument('--tokens-per-second', type=float, default=50)
+    parser.add_argument('--model-parallel', type=int, default=8)
+    parser.add_argument('--drain-timeout', type=float, default=60, help='seconds to wait for pending translations')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results from an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    app, socketio = build_app(args)
+    recorder = Recorder()
+    instrument(socketio, recorder)
+    users = create_users(app, max(2, args.users), args.language)
+    counter = itertools.count()
+
+    scenarios = args.scenarios.split(',')
+    sync_cursor = None
+    if {'history', 'sync', 'search'} & set(scenarios):
+        seed_history(app, users[0][0], users[1][0], args.history)
+        wait_for_translations(recorder, args.drain_timeout)
+        sync_cursor = missed_cursor(app, args.sync_missed)
+
+    results = []
+    print(f"{'scenario':<10}{'conc':>6}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'e2e p95':>10}"
+          f"{'errors':>8}{'shed':>6}")
+    for scenario in scenarios:
+        for concurrency in (int(level) for level in args.concurrency.split(',')):
+            recorder.reset()
+            latencies, errors, shed, elapsed = run_level(
+                app, socketio, users, scenario, concurrency, args, counter, sync_cursor
+            )
+            wait_for_translations(recorder, args.drain_timeout)
+
+            result = {
+                'scenario': scenario,
+                'concurrency': concurrency,
+                'requests': len(latencies),
+                'errors': errors,
+                'shed': shed,
+                'seconds': round(elapsed, 3),
+                'throughput_rps': round(len(latencies) / elapsed, 2),
+                'latency_ms': percentiles(latencies),
+                'translation_e2e_ms': percentiles(recorder.end_to_end),
+                'untranslated': len(recorder.started),
+                'stages_ms': {name: percentiles(samples) for name, samples in sorted(recorder.stages.items())}
+            }
+            results.append(result)
+            e2e = result['translation_e2e_ms']['p95'] if result['translation_e2e_ms'] else '-'
+            print(f"{scenario:<10}{concurrency:>6}{result['throughput_rps']:>10}"
+                  f"{result['latency_ms']['p50']:>10}{result['latency_ms']['p95']:>10}"
+                  f"{result['latency_ms']['p99']:>10}{e2e:>10}{errors:>8}{shed:>6}")
+
+    report = {'config': vars(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Size and encode/decode cost of translation RPC bodies per wire format.
+
+    python bench_wire.py --sizes 1,10,100,1000 --iterations 2000
+
+Each payload is a bulk request (submit_many) with that many texts of
+--words words, and the reply it gets. Every format and compression is run
+with compress_min=0, so the table shows where compression starts to pay;
+TRANSLATION_WIRE_COMPRESS_MIN should sit around that size.
+"""
+import argparse
+import json
+import random
+import time
+import wire
+
+WORDS = (
+    'the quick brown fox jumps over lazy dog hello world how are you today '
+    'see you tomorrow at the office meeting was moved to three thanks again'
+).split()
+
+def payloads(size, words):
+    rng = random.Random(size)
+    texts = [' '.join(rng.choice(WORDS) for _ in range(words)) for _ in range(size)]
+    request = {'target_language': 'es', 'source_language': 'en', 'dialect': 'mx', 'texts': texts}
+    reply = {'responses': [f'[es] {text}' for text in texts], 'errors': [None] * size}
+    return request, reply
+
+def timed(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = func()
+    return result, (time.perf_counter() - start) / iterations * 1e6
+
+def run(payload, content_type, compression, iterations):
+    codec = wire.Codec(content_type, compression, compress_min=0)
+    (body, content_type, content_encoding), encode_us = timed(lambda: codec.encode(payload), iterations)
+    decoded, decode_us = timed(lambda: codec.decode(body, content_type, content_encoding), iterations)
+    assert decoded == payload
+    return {
+        'format': 'msgpack' if content_type == wire.MSGPACK else 'json',
+        'compression': content_encoding or 'none',
+        'bytes': len(body),
+        'encode_us': round(encode_us, 1),
+        'decode_us': round(decode_us, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1,10,100,1000', help='texts per payload')
+    parser.add_argument('--words', type=int, default=12, help='words per text')
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--json', action='store_true', help='print one JSON object per result')
+    args = parser.parse_args()
+
+    formats = [wire.JSON] + ([wire.MSGPACK] if wire.msgpack is not None else [])
+    compressions = ['none'] + wire.readable_encodings()
+    if not args.json:
+        print(f"{'payload':<9}{'texts':>6}{'format':>9}{'compression':>13}{'bytes':>9}{'encode us':>11}{'decode us':>11}")
+    for size in (int(size) for size in args.sizes.split(',')):
+        # Fewer rounds for big payloads so every size takes about as long
+        iterations = max(10, args.iterations // size)
+        for name, payload in zip(('request', 'reply'), payloads(size, args.words)):
+            for content_type in formats:
+                for compression in compressions:
+                    result = dict(run(payload, content_type, compression, iterations), payload=name, texts=size)
+                    if args.json:
+                        print(json.dumps(result))
+                    else:
+                        print(f"{name:<9}{size:>6}{result['format']:>9}{result['compression']:>13}"
+                              f"{result['bytes']:>9}{result['encode_us']:>11}{result['decode_us']:>11}")
+
+if __name__ == '__main__':
+    main()
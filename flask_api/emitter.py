@@ -0,0 +1,13 @@
+from flask_socketio import SocketIO
+
+def create_emitter(config):
+    # For processes that publish events but serve no clients (CLI commands,
+    # standalone consumers). Events go onto the Socket.IO message queue and
+    # whichever web worker holds the room's connections delivers them.
+    if not config['SOCKETIO_MESSAGE_QUEUE']:
+        raise RuntimeError("SOCKETIO_MESSAGE_QUEUE must be set to emit from outside the web workers")
+    return SocketIO(
+        message_queue=config['SOCKETIO_MESSAGE_QUEUE'],
+        channel=config['SOCKETIO_CHANNEL'],
+        write_only=True
+    )
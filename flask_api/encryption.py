@@ -0,0 +1,129 @@
+import logging
+import os
+import click
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+
+def parse_keys(value):
+    # "2024-06:<fernet key>,2024-01:<fernet key>", the first entry encrypts new messages
+    keys = []
+    for entry in value.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        key_id, _, key = entry.partition(':')
+        if not key:
+            raise ValueError("MESSAGE_ENCRYPTION_KEYS entries must look like <key id>:<fernet key>")
+        keys.append((key_id.strip(), key.strip()))
+    return keys
+
+def dev_key(directory):
+    # Generated once in the instance folder and reused by every local worker.
+    # Linked into place, so workers starting together agree on one key.
+    path = os.path.join(directory, 'message_encryption.key')
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}'
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as key_file:
+            key_file.write(Fernet.generate_key().decode())
+        try:
+            os.link(temp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_path)
+    with open(path) as key_file:
+        return key_file.read().strip()
+
+class KeyRing:
+    def __init__(self, app=None, pool=None):
+        # Batches go through pool.run_batch (offload.CpuPool) when one is given
+        self.pool = pool
+        self.primary_id = None
+        self.ciphers = {}
+        self.any_key = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        keys = parse_keys(app.config['MESSAGE_ENCRYPTION_KEYS'])
+        if not keys:
+            if not app.config['MESSAGE_ENCRYPTION_DEV_KEY']:
+                raise RuntimeError(
+                    "MESSAGE_ENCRYPTION_KEYS is not set. Generate a key with "
+                    "`python -c 'from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())'` "
+                    "and set MESSAGE_ENCRYPTION_KEYS=<key id>:<key>, or MESSAGE_ENCRYPTION_DEV_KEY=true for local runs"
+                )
+            logging.warning("MESSAGE_ENCRYPTION_KEYS is not set, using the development key in the instance folder")
+            keys = [('dev', dev_key(app.instance_path))]
+        self.load(keys)
+
+        @app.cli.command('rotate-message-keys')
+        @click.option('--batch-size', default=500)
+        def rotate_message_keys(batch_size):
+            """Re-encrypt stored messages with the primary key."""
+            from extensions import db
+            from models import Message
+
+            rotated = 0
+            last_id = 0
+            while True:
+                messages = Message.query.filter(Message.id > last_id) \
+                    .order_by(Message.id).limit(batch_size).all()
+                if not messages:
+                    break
+                for message in messages:
+                    if message.encryption_key_id != self.primary_id:
+                        message.content_encrypted = self.rotate(message.content_encrypted)
+                        message.encryption_key_id = self.primary_id
+                        rotated += 1
+                last_id = messages[-1].id
+                db.session.commit()
+            click.echo(f"Re-encrypted {rotated} messages with key {self.primary_id}")
+
+    def load(self, keys):
+        # Fernet objects are built once here and reused for every message
+        self.primary_id = keys[0][0]
+        self.ciphers = {key_id: Fernet(key) for key_id, key in keys}
+        self.any_key = MultiFernet([self.ciphers[key_id] for key_id, _ in keys])
+
+    def encrypt(self, plaintext):
+        return self.primary_id, self.ciphers[self.primary_id].encrypt(plaintext.encode())
+
+    def encrypt_many(self, plaintexts):
+        # Returns the key id and one token per plaintext
+        if self.pool is not None:
+            return self.primary_id, self.pool.run_batch(self._encrypt_many, plaintexts)
+        return self.primary_id, self._encrypt_many(plaintexts)
+
+    def _encrypt_many(self, plaintexts):
+        encrypt = self.ciphers[self.primary_id].encrypt
+        return [encrypt(plaintext.encode()) for plaintext in plaintexts]
+
+    def decrypt(self, key_id, token):
+        cipher = self.ciphers.get(key_id, self.any_key)
+        return cipher.decrypt(token).decode()
+
+    def decrypt_many(self, rows):
+        # rows are (key_id, token) pairs; undecryptable tokens come back as None
+        if self.pool is not None:
+            return self.pool.run_batch(self._decrypt_many, rows)
+        return self._decrypt_many(rows)
+
+    def _decrypt_many(self, rows):
+        ciphers = self.ciphers
+        any_key = self.any_key
+        results = []
+        append = results.append
+        failures = 0
+        for key_id, token in rows:
+            try:
+                append(ciphers.get(key_id, any_key).decrypt(token).decode())
+            except InvalidToken:
+                append(None)
+                failures += 1
+        if failures:
+            logging.warning(f"Could not decrypt {failures} of {len(results)} messages")
+        return results
+
+    def rotate(self, token):
+        return self.any_key.rotate(token)
@@ -0,0 +1,104 @@
+import functools
+import logging
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+REPLICA = 'replica'
+
+def engine_options(url, config):
+    # Every greenlet that touches the database holds one pooled connection, so
+    # pool_size + max_overflow caps connections per process however many
+    # requests are in flight; the rest wait up to pool_timeout, then fail.
+    url = make_url(url)
+    options = {'pool_pre_ping': config['DATABASE_POOL_PRE_PING']}
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # Flask-SQLAlchemy gives in-memory SQLite a single static connection
+        return options
+    if url.get_backend_name() == 'postgresql' and config['DATABASE_STATEMENT_TIMEOUT_MS']:
+        options['connect_args'] = {'options': f"-c statement_timeout={config['DATABASE_STATEMENT_TIMEOUT_MS']}"}
+    options.update({
+        'pool_size': config['DATABASE_POOL_SIZE'],
+        'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+        'pool_timeout': config['DATABASE_POOL_TIMEOUT'],
+        'pool_recycle': config['DATABASE_POOL_RECYCLE']
+    })
+    return options
+
+def green_psycopg():
+    # psycopg2 blocks the whole eventlet hub on every query unless it is told to
+    # wait through eventlet; without this a bigger pool buys no concurrency
+    try:
+        from psycogreen.eventlet import patch_psycopg
+    except ImportError:
+        logging.warning("psycogreen is not installed, PostgreSQL queries block other greenlets")
+        return
+    patch_psycopg()
+
+def configure(app):
+    # Call before db.init_app: fills in engine options and the replica bind
+    # unless SQLALCHEMY_ENGINE_OPTIONS/SQLALCHEMY_BINDS are set explicitly
+    config = app.config
+    url = config['SQLALCHEMY_DATABASE_URI']
+    if not config.get('SQLALCHEMY_ENGINE_OPTIONS'):
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url, config)
+    if config['DATABASE_REPLICA_URL'] and not config.get('SQLALCHEMY_BINDS'):
+        replica = config['DATABASE_REPLICA_URL']
+        config['SQLALCHEMY_BINDS'] = {REPLICA: dict(engine_options(replica, config), url=replica)}
+    backends = {make_url(url).get_backend_name()}
+    if config['DATABASE_REPLICA_URL']:
+        backends.add(make_url(config['DATABASE_REPLICA_URL']).get_backend_name())
+    if 'postgresql' in backends:
+        green_psycopg()
+
+def sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # Safe with WAL, and a commit no longer waits for an fsync
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    # Off by default in SQLite; ON DELETE CASCADE (translations, jobs, search documents) needs it
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+def init_app(app, db):
+    # Call after db.init_app, once the engines exist
+    with app.app_context():
+        for key, engine in db.engines.items():
+            if engine.dialect.name != 'sqlite':
+                continue
+            event.listen(engine, 'connect', sqlite_pragmas)
+            if app.config['DATABASE_SQLITE_WAL'] and engine.url.database not in (None, '', ':memory:'):
+                # WAL lets readers carry on while a message is being written; it is
+                # a property of the database file, so setting it once is enough
+                with engine.connect() as connection:
+                    mode = connection.exec_driver_sql('PRAGMA journal_mode=WAL').scalar()
+                if mode != 'wal':
+                    logging.warning(f"SQLite database {engine.url.database} is in {mode} mode, not WAL")
+
+class RoutingSession(Session):
+    # Inside read_replica handlers, queries go to the replica bind when one is
+    # configured; flushes and everything else go to the primary
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context() and g.get('read_replica'):
+            engine = self._db.engines.get(REPLICA)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+def read_replica(func):
+    # For read-only handlers that can live with replication lag
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        g.read_replica = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            g.pop('read_replica', None)
+    return wrapper
+
+def pool_stats(db):
+    # (bind, checked out, idle) for each engine with a queue pool
+    return [
+        (key or 'default', engine.pool.checkedout(), engine.pool.checkedin())
+        for key, engine in db.engines.items() if hasattr(engine.pool, 'checkedout')
+    ]
@@ -4,10 +4,17 @@ from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
 from flask_login import LoginManager
 from flask_socketio import SocketIO
+from encryption import KeyRing
+from engines import RoutingSession
+from offload import CpuPool
+from metrics import Metrics
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 ma = Marshmallow()
 migrate = Migrate()
 jwt = JWTManager()
 login_manager = LoginManager()
-socketio = SocketIO()
\ No newline at end of file
+socketio = SocketIO()
+cpu_pool = CpuPool()
+message_keyring = KeyRing(pool=cpu_pool)
+metrics = Metrics()
\ No newline at end of file
@@ -0,0 +1,219 @@
+"""In-process stand-in for RabbitMQ plus a stub LLM worker, for benchmarks.
+
+install() swaps translation_service.open_connection for FakeConnection, so
+the real TranslationServiceClient (channel pool, reply consumer, futures,
+streaming) runs unchanged against queues that live in this process. The
+StubModel answers like llm_service would, with a configurable first-token
+latency, token rate and number of parallel model slots.
+"""
+import itertools
+import queue
+import threading
+import time
+import types
+import pika
+import wire
+
+class FakeBroker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.backlog = {}
+        self.consumers = {}
+        self.names = itertools.count()
+        self.request_handler = None
+
+    def declare(self, name):
+        with self.lock:
+            if not name:
+                name = f'amq.gen-{next(self.names)}'
+            self.backlog.setdefault(name, [])
+            return name
+
+    def consume(self, name, connection, callback):
+        with self.lock:
+            self.consumers[name] = (connection, callback)
+            backlog, self.backlog[name] = self.backlog.get(name, []), []
+        for properties, body in backlog:
+            connection.inbox.put((callback, name, properties, body))
+
+    def publish(self, routing_key, properties, body):
+        if routing_key.startswith('llm_requests') and self.request_handler is not None:
+            self.request_handler(properties, body)
+            return
+        with self.lock:
+            consumer = self.consumers.get(routing_key)
+            if consumer is None:
+                self.backlog.setdefault(routing_key, []).append((properties, body))
+                return
+        connection, callback = consumer
+        connection.inbox.put((callback, routing_key, properties, body))
+
+    def depth(self, name):
+        with self.lock:
+            return len(self.backlog.get(name, []))
+
+class FakeChannel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.broker = connection.broker
+        self.is_open = True
+        self.delivery_tags = itertools.count(1)
+
+    def queue_declare(self, queue='', exclusive=False, passive=False, durable=False, arguments=None):
+        name = self.broker.declare(queue)
+        return types.SimpleNamespace(method=types.SimpleNamespace(
+            queue=name, message_count=self.broker.depth(name), consumer_count=0
+        ))
+
+    def basic_qos(self, prefetch_count=0):
+        pass
+
+    def confirm_delivery(self):
+        pass
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False):
+        self.broker.consume(queue, self.connection, on_message_callback)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self.broker.publish(routing_key, properties or pika.BasicProperties(), body)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+class FakeConnection:
+    def __init__(self, broker):
+        self.broker = broker
+        self.inbox = queue.Queue()
+        self.is_open = True
+        self.is_closed = False
+        self._channel = None
+
+    def channel(self):
+        self._channel = FakeChannel(self)
+        return self._channel
+
+    def process_data_events(self, time_limit=0):
+        try:
+            item = self.inbox.get(timeout=time_limit) if time_limit else self.inbox.get_nowait()
+        except queue.Empty:
+            return
+        while True:
+            callback, name, properties, body = item
+            method = types.SimpleNamespace(
+                delivery_tag=next(self._channel.delivery_tags), routing_key=name, redelivered=False
+            )
+            callback(self._channel, method, properties, body)
+            try:
+                item = self.inbox.get_nowait()
+            except queue.Empty:
+                return
+
+    def close(self):
+        self.is_open = False
+        self.is_closed = True
+
+class StubModel:
+    def __init__(self, broker, first_token_ms=50, tokens_per_second=50, parallel=4):
+        self.broker = broker
+        self.first_token = first_token_ms / 1000.0
+        self.token_interval = 1.0 / tokens_per_second if tokens_per_second else 0.0
+        self.slots = threading.Semaphore(parallel)
+        self.calls = 0
+        self.codec = wire.Codec()
+        broker.request_handler = self.submit
+
+    def submit(self, properties, body):
+        threading.Thread(target=self.handle, args=(properties, body), daemon=True).start()
+
+    def generate(self, text, target_language):
+        # Yields one token at a time at the configured rate
+        time.sleep(self.first_token)
+        for index, word in enumerate(f'[{target_language}] {text}'.split()):
+            if index:
+                time.sleep(self.token_interval)
+            yield ('' if index == 0 else ' ') + word
+
+    def reply(self, properties, payload):
+        # Same format negotiation as llm_service.publish_reply
+        accept_encoding = (properties.headers or {}).get('accept_encoding', '')
+        body, content_type, content_encoding = self.codec.encode(
+            payload, properties.content_type or wire.JSON, accept_encoding
+        )
+        self.broker.publish(
+            properties.reply_to,
+            pika.BasicProperties(
+                correlation_id=properties.correlation_id, content_type=content_type, content_encoding=content_encoding,
+                headers={'wire': wire.VERSION}
+            ),
+            body
+        )
+
+    def handle(self, properties, body):
+        request = self.codec.decode(
+            body, properties.content_type, properties.content_encoding, (properties.headers or {}).get('wire')
+        )
+        target_language = request.get('target_language', 'en')
+        with self.slots:
+            self.calls += 1
+            if 'texts' in request:
+                # Batched decoding: one first-token delay, then as long as the longest text takes
+                texts = [f'[{target_language}] {text}' for text in request['texts']]
+                longest = max((len(text.split()) for text in texts), default=1)
+                time.sleep(self.first_token + self.token_interval * (longest - 1))
+                self.reply(properties, {'responses': texts, 'errors': [None] * len(texts)})
+                return
+
+            parts = []
+            for seq, token in enumerate(self.generate(request.get('text', ''), target_language)):
+                parts.append(token)
+                if request.get('stream'):
+                    self.reply(properties, {'chunk': token, 'seq': seq})
+            payload = {'response': ''.join(parts)}
+            if request.get('stream'):
+                payload.update({'seq': len(parts), 'final': True})
+            self.reply(properties, payload)
+
+class RabbitMQStubWorker:
+    # Serves llm_requests from a real broker with the same StubModel, for
+    # benchmarking against a local RabbitMQ instead of the in-process queues.
+    def __init__(self, host, queue_name, queue_arguments, **model_options):
+        self.host = host
+        self.queue_name = queue_name
+        self.queue_arguments = queue_arguments
+        self.model_options = model_options
+        self.request_handler = None
+        self.connection = None
+        self.channel = None
+
+    def publish(self, routing_key, properties, body):
+        # StubModel replies from its own threads; pika needs them on the connection thread
+        self.connection.add_callback_threadsafe(
+            lambda: self.channel.basic_publish(exchange='', routing_key=routing_key, properties=properties, body=body)
+        )
+
+    def run(self):
+        self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host))
+        self.channel = self.connection.channel()
+        self.channel.queue_declare(queue=self.queue_name, arguments=self.queue_arguments)
+        StubModel(self, **self.model_options)
+        self.channel.basic_consume(
+            queue=self.queue_name,
+            on_message_callback=lambda ch, method, props, body: self.request_handler(props, body),
+            auto_ack=True
+        )
+        self.channel.start_consuming()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+def install(first_token_ms=50, tokens_per_second=50, parallel=4):
+    import translation_service
+
+    broker = FakeBroker()
+    model = StubModel(broker, first_token_ms, tokens_per_second, parallel)
+    translation_service.open_connection = lambda: FakeConnection(broker)
+    return broker, model
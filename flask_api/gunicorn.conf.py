@@ -0,0 +1,14 @@
+import os
+
+# One eventlet worker per gunicorn process: Socket.IO long-polling needs every
+# request of a session to reach the same process, and gunicorn cannot pin
+# clients to workers. start.sh runs one gunicorn per port and nginx pins
+# clients to a port with ip_hash.
+worker_class = 'eventlet'
+workers = 1
+# Concurrent connections (websockets included) per process
+worker_connections = int(os.environ.get('FLASK_WORKER_CONNECTIONS', 2000))
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5001')
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+accesslog = '-'
@@ -0,0 +1,361 @@
+import json
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+import click
+import eventlet
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from extensions import db, socketio
+from models import Message, MessageTranslation, TranslationJob
+from translation_service import TranslationError, PRIORITY_INTERACTIVE, PRIORITY_BULK
+from admission import REJECT
+from timing import span
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_DEAD = 'dead'
+
+def backoff(attempts, base, cap):
+    # Exponential with jitter, so jobs that failed together do not retry together
+    delay = min(cap, base * 2 ** max(0, attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class TranslationJobs:
+    # Durable record of every translation a message still needs. Jobs are
+    # written in the same transaction as their message, so a crash, restart or
+    # broker outage can delay a translation but not lose it: the sweeper picks
+    # up jobs whose retry is due and running jobs whose lease ran out.
+    # Claiming is one conditional UPDATE, so however many workers see a job
+    # only one translates it, and a job's (message, language, dialect) key
+    # keeps its stored translation unique.
+    def __init__(self, client, app=None, admission=None, index=None):
+        self.client = client
+        # Sweeps pause while admission control is rejecting new work
+        self.admission = admission
+        # Stored translations are added to their readers' search documents
+        self.index = index
+        self.emitter = socketio
+        self.sweeper = None
+        self.completed = 0
+        self.retried = 0
+        self.dead = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_attempts = app.config['TRANSLATION_JOB_MAX_ATTEMPTS']
+        self.backoff_base = app.config['TRANSLATION_JOB_BACKOFF']
+        self.backoff_max = app.config['TRANSLATION_JOB_BACKOFF_MAX']
+        self.lease_grace = app.config['TRANSLATION_JOB_LEASE_GRACE']
+        self.sweep_interval = app.config['TRANSLATION_SWEEP_INTERVAL']
+        self.sweep_batch = app.config['TRANSLATION_SWEEP_BATCH']
+        app.extensions['translation_jobs'] = self
+        app.cli.add_command(jobs_cli)
+
+    def enqueue(self, rows):
+        # rows are message_id/source_language/language/dialect/recipients dicts.
+        # Runs in the caller's transaction; returns job ids in the same order.
+        if not rows:
+            return []
+        now = datetime.utcnow()
+        for row in rows:
+            row.update({'recipients': json.dumps(row['recipients']), 'state': JOB_PENDING, 'attempts': 0,
+                        'next_attempt_at': now, 'created_at': now, 'updated_at': now})
+        return db.session.scalars(
+            insert(TranslationJob).returning(TranslationJob.id, sort_by_parameter_order=True), rows
+        ).all()
+
+    def claimable(self, now):
+        return or_(
+            and_(TranslationJob.state == JOB_PENDING, TranslationJob.next_attempt_at <= now),
+            and_(TranslationJob.state == JOB_RUNNING, TranslationJob.locked_until < now)
+        )
+
+    def claim(self, job_ids, timeout):
+        # Returns the claimed jobs as plain dicts with their message's content
+        now = datetime.utcnow()
+        with span('db.commit'):
+            claimed = db.session.scalars(
+                update(TranslationJob)
+                .where(TranslationJob.id.in_(job_ids), self.claimable(now))
+                .values(
+                    state=JOB_RUNNING,
+                    attempts=TranslationJob.attempts + 1,
+                    locked_until=now + timedelta(seconds=timeout + self.lease_grace),
+                    updated_at=now
+                )
+                .returning(TranslationJob.id),
+                execution_options={'synchronize_session': False}
+            ).all()
+            db.session.commit()
+        if not claimed:
+            return []
+
+        with span('db.query'):
+            rows = db.session.query(TranslationJob, Message).join(
+                Message, Message.id == TranslationJob.message_id
+            ).filter(TranslationJob.id.in_(claimed)).all()
+        with span('decrypt'):
+            Message.decrypt_many([message for _, message in rows])
+        jobs = [{
+            'id': job.id,
+            'message_id': message.id,
+            'sender_id': message.sender_id,
+            'content': message.content,
+            'source_language': job.source_language or '',
+            'language': job.language,
+            'dialect': job.dialect,
+            'recipients': json.loads(job.recipients),
+            'attempts': job.attempts
+        } for job, message in rows]
+        db.session.commit()
+        return jobs
+
+    def run(self, app, job_ids, notify=True, timeout=None, priority=None):
+        # Translates the claimable jobs among job_ids, one request per
+        # (source language, language, dialect). Returns {job id: translation},
+        # None for jobs that failed this attempt. Never raises for a failed
+        # translation; the job is rescheduled instead.
+        many = len(job_ids) > 1
+        priority = priority or (PRIORITY_BULK if many else PRIORITY_INTERACTIVE)
+        timeout = timeout or app.config['TRANSLATION_BULK_TIMEOUT' if many else 'TRANSLATION_TIMEOUT']
+        with app.app_context():
+            jobs = self.claim(job_ids, timeout)
+        if not jobs:
+            return {}
+
+        groups = {}
+        for job in jobs:
+            groups.setdefault((job['source_language'], job['language'], job['dialect']), []).append(job)
+
+        results = {}
+        errors = {}
+        for (source_language, language, dialect), group in groups.items():
+            trace_id = f"message-{group[0]['message_id']}" if len(group) == 1 else f"bulk-{group[0]['message_id']}"
+            started = time.perf_counter()
+            try:
+                with span('rpc.wait'):
+                    if len(group) == 1 and not many:
+                        translations = [self.client.translate(
+                            group[0]['content'], language, source_language=source_language, dialect=dialect,
+                            timeout=timeout, priority=priority, on_chunk=self.chunk_handler(app, group[0], notify),
+                            trace_id=trace_id
+                        )]
+                    else:
+                        translations = self.client.translate_many(
+                            [job['content'] for job in group], language, source_language=source_language,
+                            dialect=dialect, timeout=timeout, priority=priority, trace_id=trace_id
+                        )
+            except TranslationError as error:
+                logging.error(f"Translation of {len(group)} job(s) to {language} failed (trace {trace_id}): {error}")
+                translations = [None] * len(group)
+                for job in group:
+                    errors[job['id']] = str(error) or error.__class__.__name__
+            else:
+                logging.debug(f"Translated {len(group)} job(s) to {language} (trace {trace_id}) "
+                              f"in {time.perf_counter() - started:.3f}s")
+            for job, translated in zip(group, translations):
+                results[job['id']] = translated
+                if translated is None:
+                    errors.setdefault(job['id'], 'No translation returned')
+
+        with app.app_context():
+            dead = self.finish(jobs, results, errors)
+        if notify:
+            self.notify(jobs, results, dead)
+        return results
+
+    def chunk_handler(self, app, job, notify):
+        if not notify or not app.config['TRANSLATION_STREAMING'] or self.emitter is None:
+            return None
+
+        def on_chunk(seq, chunk):
+            with span('emit'):
+                for recipient_id in job['recipients']:
+                    self.emitter.emit(
+                        'translation_chunk', {'id': job['message_id'], 'seq': seq, 'chunk': chunk},
+                        room=str(recipient_id)
+                    )
+        return on_chunk
+
+    def finish(self, jobs, results, errors):
+        # Stores translations and moves every job on: done, back to pending
+        # with a backoff, or dead once it has used all its attempts
+        now = datetime.utcnow()
+        translations = [
+            {'message_id': job['message_id'], 'language': job['language'], 'dialect': job['dialect'],
+             'content': results[job['id']], 'created_at': now}
+            for job in jobs if results.get(job['id']) is not None
+        ]
+        job_updates = []
+        dead = set()
+        for job in jobs:
+            if results.get(job['id']) is not None:
+                job_updates.append({'id': job['id'], 'state': JOB_DONE, 'locked_until': None,
+                                    'last_error': None, 'updated_at': now})
+                self.completed += 1
+            elif job['attempts'] >= self.max_attempts:
+                job_updates.append({'id': job['id'], 'state': JOB_DEAD, 'locked_until': None,
+                                    'last_error': errors.get(job['id']), 'updated_at': now})
+                dead.add(job['id'])
+                self.dead += 1
+                logging.error(f"Translation job {job['id']} (message {job['message_id']}) gave up after "
+                              f"{job['attempts']} attempts: {errors.get(job['id'])}")
+            else:
+                delay = backoff(job['attempts'], self.backoff_base, self.backoff_max)
+                job_updates.append({'id': job['id'], 'state': JOB_PENDING, 'locked_until': None,
+                                    'next_attempt_at': now + timedelta(seconds=delay),
+                                    'last_error': errors.get(job['id']), 'updated_at': now})
+                self.retried += 1
+
+        for attempt in range(2):
+            try:
+                with span('db.commit'):
+                    stored = self.store_translations(translations)
+                    if self.index is not None:
+                        readers = {
+                            (job['message_id'], job['language'], job['dialect']): job['recipients'] for job in jobs
+                        }
+                        self.index.add_translations([
+                            (row['message_id'], readers[row['message_id'], row['language'], row['dialect']],
+                             row['content'])
+                            for row in stored
+                        ])
+                    if translations:
+                        db.session.execute(update(Message), [
+                            {'id': message_id, 'translated': True}
+                            for message_id in {row['message_id'] for row in translations}
+                        ])
+                    db.session.execute(update(TranslationJob), job_updates)
+                    db.session.commit()
+                break
+            except IntegrityError:
+                # A job whose lease expired was finished twice; the second pass skips what the other stored
+                db.session.rollback()
+                if attempt:
+                    raise
+        return dead
+
+    def store_translations(self, rows):
+        # Returns the rows that were not stored yet, and now are
+        if not rows:
+            return []
+        stored = set(db.session.query(
+            MessageTranslation.message_id, MessageTranslation.language, MessageTranslation.dialect
+        ).filter(MessageTranslation.message_id.in_({row['message_id'] for row in rows})).all())
+        rows = [row for row in rows if (row['message_id'], row['language'], row['dialect']) not in stored]
+        if rows:
+            db.session.execute(insert(MessageTranslation), rows)
+        return rows
+
+    def notify(self, jobs, results, dead):
+        if self.emitter is None:
+            return
+        with span('emit'):
+            for job in jobs:
+                rooms = {job['sender_id'], *job['recipients']}
+                translated = results.get(job['id'])
+                if translated is not None:
+                    event, payload = 'message_translated', {
+                        'id': job['message_id'],
+                        'translated': True,
+                        'translated_content': translated,
+                        'language': job['language'],
+                        'dialect': job['dialect']
+                    }
+                elif job['id'] in dead:
+                    event, payload = 'translation_failed', {
+                        'id': job['message_id'], 'language': job['language'], 'dialect': job['dialect']
+                    }
+                else:
+                    continue
+                for room in rooms:
+                    self.emitter.emit(event, payload, room=str(room))
+
+    def due(self, limit):
+        now = datetime.utcnow()
+        return db.session.scalars(
+            select(TranslationJob.id).where(self.claimable(now))
+            .order_by(TranslationJob.next_attempt_at).limit(limit)
+        ).all()
+
+    def sweep(self, app):
+        # One pass: every due or stuck job, in batches, until none are left.
+        # Swept jobs (retries, work deferred by admission control) go out at bulk priority.
+        swept = 0
+        while True:
+            with app.app_context():
+                if self.admission is not None and self.admission.pressure(pending=False) == REJECT:
+                    logging.info("Translation queue is overloaded, pausing the sweep")
+                    return swept
+                job_ids = self.due(self.sweep_batch)
+            if not job_ids:
+                return swept
+            swept += len(job_ids)
+            results = self.run(app, job_ids, priority=PRIORITY_BULK)
+            if not results:
+                # Everything was claimed by someone else meanwhile
+                return swept
+
+    def start_sweeper(self, app):
+        if not self.sweep_interval or self.sweeper is not None:
+            return None
+
+        def loop():
+            while True:
+                eventlet.sleep(self.sweep_interval * random.uniform(0.5, 1.5))
+                try:
+                    swept = self.sweep(app)
+                    if swept:
+                        logging.info(f"Swept {swept} translation job(s)")
+                except Exception:
+                    logging.exception("Translation job sweep failed")
+
+        self.sweeper = socketio.start_background_task(loop)
+        return self.sweeper
+
+    def counts(self):
+        return dict(db.session.query(TranslationJob.state, func.count(TranslationJob.id))
+                    .group_by(TranslationJob.state).all())
+
+    def stats(self):
+        return {'completed': self.completed, 'retried': self.retried, 'dead': self.dead}
+
+jobs_cli = AppGroup('jobs', help='Inspect and re-run translation jobs.')
+
+@jobs_cli.command('stats')
+def stats_command():
+    """Number of translation jobs in each state."""
+    for state, count in sorted(current_app.extensions['translation_jobs'].counts().items()):
+        click.echo(f'{state:<10}{count:>10}')
+
+@jobs_cli.command('sweep')
+def sweep_command():
+    """Run every due or stuck job once, then exit."""
+    from emitter import create_emitter
+
+    jobs = current_app.extensions['translation_jobs']
+    if current_app.config['SOCKETIO_MESSAGE_QUEUE']:
+        jobs.emitter = create_emitter(current_app.config)
+    else:
+        # socketio here has no clients, there is nobody to notify
+        jobs.emitter = None
+    click.echo(f'Swept {jobs.sweep(current_app._get_current_object())} job(s)')
+
+@jobs_cli.command('retry-dead')
+@click.option('--message-id', type=int, help='Only the jobs of this message')
+def retry_dead_command(message_id):
+    """Give dead jobs a fresh set of attempts."""
+    query = update(TranslationJob).where(TranslationJob.state == JOB_DEAD)
+    if message_id is not None:
+        query = query.where(TranslationJob.message_id == message_id)
+    result = db.session.execute(query.values(
+        state=JOB_PENDING, attempts=0, next_attempt_at=datetime.utcnow(), updated_at=datetime.utcnow()
+    ), execution_options={'synchronize_session': False})
+    db.session.commit()
+    click.echo(f'Requeued {result.rowcount} job(s)')
@@ -0,0 +1,103 @@
+import re
+
+# Cheap local language identification, good enough to decide whether a
+# message needs the model at all. A script only names a language when most
+# of the letters are in it, so a foreign word in a sentence decides nothing;
+# scripts several languages share also need letters only one of them uses.
+# Latin-script languages are told apart by counting frequent function words.
+# Anything it is not sure about comes back as '' and is translated as usual.
+
+# Share of the letters a script needs before it can decide the language
+SCRIPT_MAJORITY = 0.5
+
+LETTER = re.compile(r'[^\W\d_]')
+LATIN = re.compile(r'[a-zA-Zß-ɏ]')
+KANA = re.compile(r'[぀-ヿ]')
+HAN = re.compile(r'[一-鿿]')
+
+# Scripts written by essentially one language
+SCRIPTS = (
+    ('ko', re.compile(r'[가-힯ᄀ-ᇿ]')),
+    ('el', re.compile(r'[Ͱ-Ͽ]')),
+    ('he', re.compile(r'[֐-׿]')),
+    ('th', re.compile(r'[฀-๿]')),
+)
+
+# Shared scripts: (language, letters only it uses, letters that rule it out)
+SHARED_SCRIPTS = (
+    (re.compile(r'[Ѐ-ӿ]'), (
+        ('ru', 'ыэё', 'іїєґўђћџљњј'),
+        ('uk', 'їєґ', 'ыэъёў'),
+    )),
+    (re.compile(r'[؀-ۿ]'), (
+        ('ur', 'ٹڈڑںےۓ', ''),
+        ('fa', 'پچژگکی', 'ٹڈڑںےۓ'),
+        ('ar', 'ةيك', 'پچژگکیٹڈڑںےۓ'),
+    )),
+)
+
+STOPWORDS = {
+    'en': 'the and is are was were you your i my me it this that to of in for on with have has do does not '
+          'what how when where be will can just but so at we they he she',
+    'es': 'el la los las es son está estás estoy que de en y un una por para con no sí qué cómo cuando '
+          'donde yo tú mi tu pero muy hola gracias también lo le se su',
+    'pt': 'o a os as é são está estou que de em e um uma por para com não sim você eu meu minha mas '
+          'muito olá obrigado obrigada também do da no na',
+    'fr': 'le la les est sont je tu il elle nous vous que de et un une pour avec ne pas oui quoi comment '
+          'mais très bonjour merci aussi du des au ce mon ma',
+    'de': 'der die das ist sind ich du er sie wir ihr und ein eine nicht ja was wie wann wo mit für aber '
+          'sehr hallo danke auch zu den dem mein',
+    'it': 'il lo la gli le è sono io tu lui lei noi voi che di e un una per con non sì cosa come quando '
+          'ma molto ciao grazie anche del della mio',
+    'nl': 'de het een is zijn ik jij je hij zij wij en van niet ja wat hoe wanneer waar met voor maar '
+          'heel hallo dank ook mijn',
+}
+STOPWORDS = {language: frozenset(words.split()) for language, words in STOPWORDS.items()}
+
+WORD = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+
+def detect_language(text, min_words=2, min_margin=1):
+    """Returns an ISO 639-1 code for text, or '' when unsure."""
+    if not text:
+        return ''
+    sample = text[:400]
+    letters = len(LETTER.findall(sample))
+    if not letters:
+        return ''
+
+    def majority(*patterns):
+        return sum(len(pattern.findall(sample)) for pattern in patterns) > letters * SCRIPT_MAJORITY
+
+    for language, pattern in SCRIPTS:
+        if majority(pattern):
+            return language
+    if majority(KANA, HAN):
+        # Japanese mixes kana into its kanji, Chinese has none
+        return 'ja' if KANA.search(sample) else 'zh'
+    for pattern, languages in SHARED_SCRIPTS:
+        if majority(pattern):
+            found = set(sample.lower())
+            for language, own, others in languages:
+                if found & set(own) and not found & set(others):
+                    return language
+            return ''
+    if not majority(LATIN):
+        return ''
+
+    scores = dict.fromkeys(STOPWORDS, 0)
+    for word in WORD.findall(sample.lower()):
+        for language, words in STOPWORDS.items():
+            if word in words:
+                scores[language] += 1
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    (best, score), (_, runner_up) = ranked[0], ranked[1]
+    if score < min_words or score - runner_up < min_margin:
+        return ''
+    return best
+
+def base_language(code):
+    # 'es-MX' and 'es_mx' are both Spanish as far as skipping the model goes
+    return (code or '').replace('_', '-').split('-')[0].lower()
+
+def same_language(source_language, target_language):
+    return bool(source_language) and base_language(source_language) == base_language(target_language)
@@ -0,0 +1,195 @@
+import logging
+import time
+from flask import Response, g, request
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Histogram, ProcessCollector, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from timing import Profiler, add_sink
+from engines import pool_stats
+
+# Spans range from sub-millisecond (encrypt) to a full model round trip
+BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300)
+
+class RuntimeCollector:
+    # Gauges and counters read from live objects at scrape time, so the hot
+    # path does not pay for them
+    def __init__(self, client, cache, profiles, memory, jobs, db, cpu_pool, passwords, limiter, admission):
+        self.client = client
+        self.cache = cache
+        self.profiles = profiles
+        self.memory = memory
+        self.jobs = jobs
+        self.db = db
+        self.cpu_pool = cpu_pool
+        self.passwords = passwords
+        self.limiter = limiter
+        self.admission = admission
+
+    def collect(self):
+        yield GaugeMetricFamily(
+            'translation_api_rpc_in_flight', 'Translation requests waiting for a reply',
+            value=self.client.in_flight
+        )
+        yield GaugeMetricFamily(
+            'translation_api_rpc_channels_in_use', 'RabbitMQ channels checked out of the pool',
+            value=self.client.pool.in_use
+        )
+
+        depth = GaugeMetricFamily(
+            'translation_api_queue_depth', 'Translation requests waiting in RabbitMQ', labels=['queue']
+        )
+        consumers = GaugeMetricFamily(
+            'translation_api_queue_consumers', 'Workers consuming each request queue', labels=['queue']
+        )
+        # Only while the reply consumer is connected, so a broker outage cannot
+        # stall scrapes behind connection retries
+        if self.client.ready.is_set():
+            try:
+                for queue_name, message_count, consumer_count in self.client.queue_depths(timeout=1):
+                    depth.add_metric([queue_name], message_count)
+                    consumers.add_metric([queue_name], consumer_count)
+            except Exception as error:
+                logging.warning(f"Could not read RabbitMQ queue depths: {error}")
+        yield depth
+        yield consumers
+
+        stats = self.cache.stats()
+        lookups = CounterMetricFamily(
+            'translation_api_cache_lookups', 'Translation cache lookups by result', labels=['result']
+        )
+        lookups.add_metric(['hit'], stats['hits'])
+        lookups.add_metric(['shared_hit'], stats['shared_hits'])
+        lookups.add_metric(['miss'], stats['misses'])
+        yield lookups
+        yield GaugeMetricFamily(
+            'translation_api_cache_entries', 'Entries in the in-process translation cache', value=stats['size']
+        )
+
+        stats = self.profiles.stats()
+        lookups = CounterMetricFamily(
+            'translation_api_profile_cache_lookups', 'User profile cache lookups by result', labels=['result']
+        )
+        lookups.add_metric(['hit'], stats['hits'])
+        lookups.add_metric(['miss'], stats['misses'])
+        yield lookups
+
+        stats = self.memory.stats()
+        segments = CounterMetricFamily(
+            'translation_api_memory_segments', 'Sentences looked up in translation memory by result', labels=['result']
+        )
+        segments.add_metric(['hit'], stats['exact_hits'])
+        segments.add_metric(['miss'], stats['segments'] - stats['exact_hits'])
+        yield segments
+        characters = CounterMetricFamily(
+            'translation_api_memory_characters', 'Source characters served from memory or sent to the model',
+            labels=['source']
+        )
+        characters.add_metric(['memory'], stats['saved_chars'])
+        characters.add_metric(['model'], stats['model_chars'])
+        yield characters
+        yield CounterMetricFamily(
+            'translation_api_memory_references', 'Similar sentences sent to the model as references',
+            value=stats['fuzzy_matches']
+        )
+        yield GaugeMetricFamily(
+            'translation_api_memory_indexed', 'Sentences in the in-process similarity index', value=stats['indexed']
+        )
+
+        stats = self.jobs.stats()
+        attempts = CounterMetricFamily(
+            'translation_api_job_attempts', 'Translation job attempts finished by this process, by outcome',
+            labels=['outcome']
+        )
+        attempts.add_metric(['done'], stats['completed'])
+        attempts.add_metric(['retry'], stats['retried'])
+        attempts.add_metric(['dead'], stats['dead'])
+        yield attempts
+
+        connections = GaugeMetricFamily(
+            'translation_api_db_connections', 'Pooled database connections by bind and state', labels=['bind', 'state']
+        )
+        for bind, checked_out, idle in pool_stats(self.db):
+            connections.add_metric([bind, 'checked_out'], checked_out)
+            connections.add_metric([bind, 'idle'], idle)
+        yield connections
+
+        yield GaugeMetricFamily(
+            'translation_api_cpu_offload_in_use', 'Password hashing calls running on the native thread pool',
+            value=self.cpu_pool.in_use
+        )
+        yield CounterMetricFamily(
+            'translation_api_cpu_offload_calls', 'Calls handed to the native thread pool', value=self.cpu_pool.calls
+        )
+        stats = self.passwords.stats()
+        lookups = CounterMetricFamily(
+            'translation_api_credential_cache_lookups', 'Password checks by credential cache result', labels=['result']
+        )
+        lookups.add_metric(['hit'], stats['hits'])
+        lookups.add_metric(['miss'], stats['misses'])
+        yield lookups
+        stats = self.limiter.stats()
+        checks = CounterMetricFamily(
+            'translation_api_rate_limit_checks', 'Rate limit checks by limit and result', labels=['limit', 'result']
+        )
+        for result in ('allowed', 'limited'):
+            for name, count in stats[result].items():
+                checks.add_metric([name, result], count)
+        yield checks
+        stats = self.admission.stats()
+        decisions = CounterMetricFamily(
+            'translation_api_admission_decisions', 'Admission decisions for new translation work', labels=['decision']
+        )
+        for decision, count in stats['decisions'].items():
+            decisions.add_metric([decision], count)
+        yield decisions
+        yield GaugeMetricFamily(
+            'translation_api_admission_queue_depth', 'Translation queue depth last read by admission control',
+            value=stats['queue_depth']
+        )
+
+class Metrics:
+    def __init__(self):
+        self.registry = CollectorRegistry()
+        ProcessCollector(registry=self.registry)
+        self.stage_seconds = Histogram(
+            'translation_api_stage_seconds', 'Time spent in each hot-path stage',
+            ['stage'], buckets=BUCKETS, registry=self.registry
+        )
+        self.request_seconds = Histogram(
+            'translation_api_request_seconds', 'HTTP request latency',
+            ['method', 'endpoint', 'status'], buckets=BUCKETS, registry=self.registry
+        )
+        self.profiler = None
+        self.collector = None
+
+    def init_app(self, app, client, cache, profiles, memory, jobs, db, cpu_pool, passwords, limiter, admission):
+        if self.collector is None:
+            self.collector = RuntimeCollector(
+                client, cache, profiles, memory, jobs, db, cpu_pool, passwords, limiter, admission
+            )
+            self.registry.register(self.collector)
+            add_sink(self.observe_stage)
+
+        self.profiler = Profiler(app.config['PROFILE_DIR'], 'flask_api')
+        if app.config['PROFILE_SIGNAL']:
+            self.profiler.install_signal()
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.add_url_rule(app.config['METRICS_PATH'], 'metrics', self.export)
+
+    def observe_stage(self, name, seconds):
+        self.stage_seconds.labels(name).observe(seconds)
+
+    def before_request(self):
+        g.request_started = time.perf_counter()
+
+    def after_request(self, response):
+        started = g.pop('request_started', None)
+        if started is not None and request.endpoint != 'metrics':
+            endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            self.request_seconds.labels(request.method, endpoint, response.status_code) \
+                .observe(time.perf_counter() - started)
+        return response
+
+    def export(self):
+        return Response(generate_latest(self.registry), content_type=CONTENT_TYPE_LATEST)
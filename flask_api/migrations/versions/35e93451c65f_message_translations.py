@@ -0,0 +1,55 @@
+"""message translations
+
+Revision ID: 35e93451c65f
+Revises: 01e902f5479e
+Create Date: 2026-10-18 03:33:38.612905
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '35e93451c65f'
+down_revision = '01e902f5479e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('message_translation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.Column('language', sa.String(length=10), nullable=False),
+    sa.Column('dialect', sa.String(length=20), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['message_id'], ['message.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('message_id', 'language', 'dialect', name='uq_message_translation_target')
+    )
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('source_language', sa.String(length=10), nullable=True))
+
+    # Every existing translation was made for 'en'
+    op.execute(
+        "INSERT INTO message_translation (message_id, language, dialect, content, created_at) "
+        "SELECT id, 'en', '', translated_content, timestamp FROM message WHERE translated_content IS NOT NULL"
+    )
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_column('translated_content')
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('translated_content', sa.TEXT(), nullable=True))
+        batch_op.drop_column('source_language')
+
+    # Only the English translations fit back into the single column
+    op.execute(
+        "UPDATE message SET translated_content = (SELECT content FROM message_translation "
+        "WHERE message_translation.message_id = message.id AND language = 'en' ORDER BY dialect LIMIT 1)"
+    )
+
+    op.drop_table('message_translation')
@@ -1,8 +1,8 @@
-from extensions import db
+from extensions import db, message_keyring
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from datetime import datetime
-from cryptography.fernet import Fernet
 
 class User(UserMixin, db.Model):
     __tablename__ = 'user'
@@ -20,12 +20,6 @@ class User(UserMixin, db.Model):
     messages_sent = db.relationship('Message', foreign_keys='Message.sender_id', backref='sender', lazy='dynamic')
     messages_received = db.relationship('Message', foreign_keys='Message.receiver_id', backref='receiver', lazy='dynamic')
 
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
-
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
-
 class Contact(db.Model):
     __tablename__ = 'contact'
 
@@ -33,30 +27,173 @@ class Contact(db.Model):
     owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     contact_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
+    # Newest message from contact_id that owner_id has read; unread counts start after it
+    last_read_message_id = db.Column(db.Integer)
+
     contact = db.relationship('User', foreign_keys=[contact_id])
 
+def conversation_key(user_id, other_id):
+    return min(user_id, other_id), max(user_id, other_id)
+
+def _conversation_low(context):
+    params = context.get_current_parameters()
+    return conversation_key(params['sender_id'], params['receiver_id'])[0]
+
+def _conversation_high(context):
+    params = context.get_current_parameters()
+    return conversation_key(params['sender_id'], params['receiver_id'])[1]
+
 class Message(db.Model):
     __tablename__ = 'message'
+    __table_args__ = (
+        # Both directions of a conversation share one key, so history reads are a single index range scan
+        db.Index('ix_message_conversation', 'conversation_low', 'conversation_high', 'timestamp', 'id'),
+        # Unread counts: messages to a user, per sender, after the last one read
+        db.Index('ix_message_receiver_sender', 'receiver_id', 'sender_id', 'id'),
+        # Sync: a user's messages after a cursor, one range scan per direction
+        db.Index('ix_message_receiver_id', 'receiver_id', 'id'),
+        db.Index('ix_message_sender_id', 'sender_id', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    conversation_low = db.Column(db.Integer, nullable=False, default=_conversation_low)
+    conversation_high = db.Column(db.Integer, nullable=False, default=_conversation_high)
     content_encrypted = db.Column(db.LargeBinary, nullable=False)
+    encryption_key_id = db.Column(db.String(32))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    # Detected when the message is written; '' when detection was not sure
+    source_language = db.Column(db.String(10))
+    # Set once every recipient can read it: translated, or already in their language
     translated = db.Column(db.Boolean, default=False)
-    translated_content = db.Column(db.Text)
+
+    translations = db.relationship('MessageTranslation', backref='message', lazy='dynamic',
+                                   cascade='all, delete-orphan', passive_deletes=True)
+    translation_jobs = db.relationship('TranslationJob', backref='message', lazy='dynamic',
+                                       cascade='all, delete-orphan', passive_deletes=True)
+    search_documents = db.relationship('SearchDocument', lazy='dynamic',
+                                       cascade='all, delete-orphan', passive_deletes=True)
 
     def encrypt_content(self, content):
-        cipher_suite = Fernet(self.get_encryption_key())
-        self.content_encrypted = cipher_suite.encrypt(content.encode())
+        self.encryption_key_id, self.content_encrypted = message_keyring.encrypt(content)
 
     def decrypt_content(self):
-        cipher_suite = Fernet(self.get_encryption_key())
-        return cipher_suite.decrypt(self.content_encrypted).decode()
+        return message_keyring.decrypt(self.encryption_key_id, self.content_encrypted)
 
     @staticmethod
-    def get_encryption_key():
-        # Ideally, store this securely
-        encryption_key = Fernet.generate_key()
-        return encryption_key
-        # return b'your-encryption-key-here'
+    def decrypt_many(messages):
+        # One pass over the page with the cached ciphers; sets .content on each message
+        contents = message_keyring.decrypt_many(
+            [(message.encryption_key_id, message.content_encrypted) for message in messages]
+        )
+        for message, content in zip(messages, contents):
+            message.content = content
+        return messages
+
+class SearchDocument(db.Model):
+    __tablename__ = 'message_search'
+    __table_args__ = (
+        # One row per message and reader: the message plus its translation into the reader's language
+        db.UniqueConstraint('message_id', 'user_id', name='uq_message_search_reader'),
+        # Searches only ever look at one user's documents (multi-column GIN, needs btree_gin)
+        db.Index('ix_message_search_document', 'user_id', 'document', postgresql_using='gin')
+        .ddl_if(dialect='postgresql'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    # The other side of the conversation, for searches within one
+    contact_id = db.Column(db.Integer, nullable=False)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id', ondelete='CASCADE'), nullable=False)
+    # tsvector on PostgreSQL; on SQLite the text itself, indexed by the message_search_fts table.
+    # Either way it holds the message's words in the clear, unlike content_encrypted.
+    document = db.Column(TSVECTOR().with_variant(db.Text(), 'sqlite'), nullable=False)
+
+# External-content FTS5 index over message_search.document, kept in step by triggers
+SQLITE_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE message_search_fts USING fts5("
+    "document, content='message_search', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER message_search_ai AFTER INSERT ON message_search BEGIN "
+    "INSERT INTO message_search_fts(rowid, document) VALUES (new.id, new.document); END",
+    "CREATE TRIGGER message_search_ad AFTER DELETE ON message_search BEGIN "
+    "INSERT INTO message_search_fts(message_search_fts, rowid, document) VALUES ('delete', old.id, old.document); END",
+    "CREATE TRIGGER message_search_au AFTER UPDATE ON message_search BEGIN "
+    "INSERT INTO message_search_fts(message_search_fts, rowid, document) VALUES ('delete', old.id, old.document); "
+    "INSERT INTO message_search_fts(rowid, document) VALUES (new.id, new.document); END",
+)
+for statement in SQLITE_SEARCH_DDL:
+    event.listen(SearchDocument.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(
+    SearchDocument.__table__, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS btree_gin').execute_if(dialect='postgresql')
+)
+
+class DeliveryCursor(db.Model):
+    __tablename__ = 'delivery_cursor'
+
+    # Where a user's last sync left off, for clients that reconnect without their own cursor
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    # Newest message delivered, newest translation id seen, oldest received message still being translated
+    message_id = db.Column(db.Integer, nullable=False, default=0)
+    translation_id = db.Column(db.Integer, nullable=False, default=0)
+    pending_from = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class MessageTranslation(db.Model):
+    __tablename__ = 'message_translation'
+    __table_args__ = (
+        # One row per target a message was translated to, shared by every recipient reading it in that language
+        db.UniqueConstraint('message_id', 'language', 'dialect', name='uq_message_translation_target'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id', ondelete='CASCADE'), nullable=False)
+    language = db.Column(db.String(10), nullable=False)
+    dialect = db.Column(db.String(20), nullable=False, default='')
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class TranslationJob(db.Model):
+    __tablename__ = 'translation_job'
+    __table_args__ = (
+        # Idempotency key: a message is translated once per target however often its job is retried
+        db.UniqueConstraint('message_id', 'language', 'dialect', name='uq_translation_job_target'),
+        # The sweeper's scan for due retries and expired leases
+        db.Index('ix_translation_job_state_due', 'state', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id', ondelete='CASCADE'), nullable=False)
+    source_language = db.Column(db.String(10))
+    language = db.Column(db.String(10), nullable=False)
+    dialect = db.Column(db.String(20), nullable=False, default='')
+    # JSON list of the user ids reading this target, for notifications
+    recipients = db.Column(db.Text, nullable=False, default='[]')
+    # pending -> running -> done, or back to pending until max attempts, then dead
+    state = db.Column(db.String(10), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # A running job whose lease expired is treated as lost and claimed again
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class TranslationCacheEntry(db.Model):
+    __tablename__ = 'translation_cache'
+
+    key = db.Column(db.String(64), primary_key=True)
+    translation = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, index=True)
+
+class TranslationMemorySegment(db.Model):
+    __tablename__ = 'translation_memory'
+
+    # sha256 of the normalized sentence, language pair, dialect and model
+    key = db.Column(db.String(64), primary_key=True)
+    source_language = db.Column(db.String(10), nullable=False, default='')
+    target_language = db.Column(db.String(10), nullable=False)
+    translation = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
@@ -0,0 +1,48 @@
+import threading
+import eventlet
+from eventlet import patcher, tpool
+
+class CpuPool:
+    # Keeps CPU-bound work from freezing every greenlet on the worker. run() hands
+    # calls that release the GIL (password hashing) to eventlet's native thread
+    # pool, at most CPU_OFFLOAD_THREADS at once; other callers wait as greenlets.
+    # run_batch() keeps GIL-bound work on the hub, where a thread would only
+    # contend for the GIL, and yields between chunks instead.
+    def __init__(self, app=None):
+        self.enabled = False
+        self.yield_every = 64
+        self.slots = None
+        self.in_use = 0
+        self.calls = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        threads = app.config['CPU_OFFLOAD_THREADS']
+        # Without eventlet's hub (plain threads, some CLI runs) tpool only adds overhead
+        self.enabled = app.config['CPU_OFFLOAD'] and patcher.is_monkey_patched('thread')
+        self.yield_every = app.config['CPU_YIELD_EVERY']
+        self.slots = threading.BoundedSemaphore(threads)
+        # Only takes effect before tpool's threads are started by the first call
+        tpool.set_num_threads(threads)
+
+    def run(self, func, *args, **kwargs):
+        if not self.enabled:
+            return func(*args, **kwargs)
+        with self.slots:
+            self.in_use += 1
+            self.calls += 1
+            try:
+                return tpool.execute(func, *args, **kwargs)
+            finally:
+                self.in_use -= 1
+
+    def run_batch(self, func, items):
+        # func(items) for per-item work that returns one result per item
+        if not self.enabled or not self.yield_every or len(items) <= self.yield_every:
+            return func(items)
+        results = []
+        for start in range(0, len(items), self.yield_every):
+            results.extend(func(items[start:start + self.yield_every]))
+            eventlet.sleep(0)
+        return results
@@ -0,0 +1,74 @@
+import base64
+from datetime import datetime
+from sqlalchemy import tuple_
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(timestamp, row_id):
+    raw = f'{timestamp.isoformat()}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, row_id = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, UnicodeDecodeError) as error:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from error
+
+def encode_sync_cursor(message_id, translation_id, pending_from):
+    raw = f'{message_id}.{translation_id}.{pending_from}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_sync_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        message_id, translation_id, pending_from = (int(part) for part in raw.split('.'))
+        return message_id, translation_id, pending_from
+    except (ValueError, UnicodeDecodeError) as error:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from error
+
+def encode_search_cursor(score, row_id):
+    # repr round-trips the float exactly, so the next page starts right after this row
+    raw = f'{score!r}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_search_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        score, row_id = raw.split('|')
+        return float(score), int(row_id)
+    except (ValueError, UnicodeDecodeError) as error:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from error
+
+def keyset_page(query, timestamp_column, id_column, limit, before=None, after=None):
+    # Pages over (timestamp, id) so every page is one index range scan, no
+    # matter how deep into the history it is. Rows come back oldest first;
+    # without a cursor the newest page is returned. 'before' is None once there
+    # is nothing older, 'after' is always usable to poll for newer rows.
+    key = tuple_(timestamp_column, id_column)
+
+    def cursor_for(row):
+        return encode_cursor(getattr(row, timestamp_column.key), getattr(row, id_column.key))
+
+    if after is not None:
+        rows = query.filter(key > decode_cursor(after)) \
+            .order_by(timestamp_column.asc(), id_column.asc()) \
+            .limit(limit).all()
+        return {
+            'items': rows,
+            'before': cursor_for(rows[0]) if rows else None,
+            'after': cursor_for(rows[-1]) if rows else after
+        }
+
+    if before is not None:
+        query = query.filter(key < decode_cursor(before))
+    rows = query.order_by(timestamp_column.desc(), id_column.desc()).limit(limit + 1).all()
+    has_older = len(rows) > limit
+    rows = rows[:limit][::-1]
+    return {
+        'items': rows,
+        'before': cursor_for(rows[0]) if rows and has_older else None,
+        'after': cursor_for(rows[-1]) if rows else None
+    }
@@ -0,0 +1,56 @@
+import hashlib
+import hmac
+import os
+from werkzeug.security import generate_password_hash, check_password_hash
+from timing import span
+from translation_cache import LRUCache
+
+class PasswordHasher:
+    # Password hashing and checks run on the CPU pool. A successful check is
+    # remembered for CREDENTIAL_CACHE_TTL seconds as an HMAC of the password
+    # under a key that never leaves this process, together with the stored hash,
+    # so repeated logins skip the KDF and a password change invalidates it.
+    def __init__(self, pool, app=None):
+        self.pool = pool
+        self.method = 'pbkdf2:sha256:260000'
+        self.salt_length = 16
+        self.cache = None
+        self.key = os.urandom(32)
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.salt_length = app.config['PASSWORD_SALT_LENGTH']
+        size = app.config['CREDENTIAL_CACHE_SIZE']
+        ttl = app.config['CREDENTIAL_CACHE_TTL']
+        self.cache = LRUCache(size, ttl) if size > 0 and ttl > 0 else None
+
+    def hash(self, password):
+        with span('auth.hash'):
+            return self.pool.run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, user_id, password_hash, password):
+        if not password_hash:
+            return False
+        digest = hmac.new(self.key, password.encode(), hashlib.sha256).digest()
+        cached = self.cache.get(user_id) if self.cache is not None else None
+        if cached is not None and cached[0] == password_hash and hmac.compare_digest(cached[1], digest):
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        with span('auth.verify'):
+            verified = self.pool.run(check_password_hash, password_hash, password)
+        if verified and self.cache is not None:
+            self.cache.set(user_id, (password_hash, digest))
+        return verified
+
+    def needs_rehash(self, password_hash):
+        # Hashes made with other PASSWORD_HASH_METHOD parameters are replaced at the next login
+        return password_hash.split('$', 1)[0] != self.method
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,48 @@
+from extensions import db
+from models import User
+from schemas import user_schema
+from translation_cache import LRUCache
+
+class ProfileCache:
+    # Read-through cache of serialized user profiles, keyed by user id. The
+    # update and delete routes invalidate their own process's entry; other
+    # web workers can serve the old profile until PROFILE_CACHE_TTL expires.
+    def __init__(self, app=None):
+        self.local = None
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.local = LRUCache(app.config['PROFILE_CACHE_SIZE'], app.config['PROFILE_CACHE_TTL'])
+
+    def get(self, user_id):
+        # Returns the profile dict, or None for an unknown user. Callers must not modify it.
+        profile = self.local.get(user_id) if self.local is not None else None
+        if profile is not None:
+            self.hits += 1
+            return profile
+
+        self.misses += 1
+        # Always from the primary: a lagging replica would keep a stale profile cached for the whole TTL
+        user = db.session.get(User, user_id, bind_arguments={'bind': db.engine})
+        if user is None:
+            return None
+        profile = user_schema.dump(user)
+        if self.local is not None:
+            self.local.set(user_id, profile)
+        return profile
+
+    def invalidate(self, user_id):
+        if self.local is not None:
+            self.local.delete(user_id)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self.local) if self.local is not None else 0
+        }
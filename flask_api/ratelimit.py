@@ -0,0 +1,141 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from flask import request
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+def parse_limit(value):
+    # "<tokens per second>/<burst>", e.g. "2/20"; empty or "0" turns the limit off
+    if not value or value.strip() in ('0', 'off'):
+        return None
+    rate, _, burst = value.partition('/')
+    rate = float(rate)
+    burst = float(burst) if burst else max(1.0, rate)
+    if rate <= 0 or burst < 1:
+        raise ValueError(f"Invalid rate limit: {value}")
+    return rate, burst
+
+class MemoryBuckets:
+    # Token buckets for this process only, least recently used dropped first.
+    # A dropped bucket comes back full, so maxsize must exceed the active keys.
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost):
+        # Returns 0 when the tokens were taken, otherwise seconds until they would be
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.maxsize:
+                self.buckets.popitem(last=False)
+        return wait
+
+# KEYS[1] bucket; ARGV rate, burst, cost. Server time, so web workers with skewed clocks agree.
+TAKE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+class RedisBuckets:
+    # Shared by every web worker, so a client spread over processes gets one budget
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(TAKE_SCRIPT)
+
+    def take(self, key, rate, burst, cost):
+        return float(self.script(keys=['ratelimit:' + key], args=[rate, burst, cost]))
+
+class RateLimiter:
+    # Per-user and per-client-IP token buckets for each named limit. The
+    # RATE_LIMITS config maps a name to {'user': "rate/burst", 'ip': "rate/burst"}.
+    def __init__(self, app=None):
+        self.enabled = False
+        self.limits = {}
+        self.store = None
+        self.ip_header = ''
+        self.allowed = {}
+        self.limited = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['RATE_LIMIT_ENABLED']
+        self.ip_header = app.config['RATE_LIMIT_IP_HEADER']
+        self.limits = {
+            name: {scope: parse_limit(value) for scope, value in scopes.items()}
+            for name, scopes in app.config['RATE_LIMITS'].items()
+        }
+        backend = app.config['RATE_LIMIT_BACKEND']
+        if backend == 'redis':
+            self.store = RedisBuckets(app.config['REDIS_URL'])
+        elif not backend:
+            self.store = MemoryBuckets(app.config['RATE_LIMIT_MAX_KEYS'])
+        else:
+            raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+
+    def client_ip(self):
+        # Only trust the proxy's header when the app is reachable through the proxy alone
+        if self.ip_header:
+            return request.headers.get(self.ip_header) or request.remote_addr
+        return request.remote_addr
+
+    def check(self, name, user_id=None, cost=1):
+        # Takes cost tokens from the user's and the client IP's buckets for this
+        # limit. Returns 0 if allowed, else whole seconds to wait (Retry-After).
+        if not self.enabled or name not in self.limits:
+            return 0
+        wait = 0.0
+        for scope, key in (('user', user_id), ('ip', self.client_ip())):
+            limit = self.limits[name].get(scope)
+            if limit is None or key is None:
+                continue
+            rate, burst = limit
+            if cost > burst:
+                # Could never be allowed; wait as if the bucket were refilled
+                wait = max(wait, cost / rate)
+                continue
+            try:
+                wait = max(wait, self.store.take(f'{name}:{scope}:{key}', rate, burst, cost))
+            except Exception as error:
+                # A broken shared store must not take the API down with it
+                logging.warning(f"Rate limit store failed, allowing request: {error}")
+        if wait > 0:
+            self.limited[name] = self.limited.get(name, 0) + 1
+            return max(1, math.ceil(wait))
+        self.allowed[name] = self.allowed.get(name, 0) + 1
+        return 0
+
+    def stats(self):
+        return {'allowed': dict(self.allowed), 'limited': dict(self.limited)}
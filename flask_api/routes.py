@@ -1,19 +1,436 @@
-from flask import jsonify, request
+from flask import jsonify, request, current_app, Response, stream_with_context
 from flask_restx import Api, Resource, fields
 from flask_jwt_extended import jwt_required, create_access_token, get_jwt_identity
-from models import User, Message, Contact
+from models import User, Message, MessageTranslation, Contact, DeliveryCursor, TranslationJob, conversation_key
 from schemas import (
     user_schema, users_schema,
     contact_schema, contacts_schema,
     message_schema, messages_schema
 )
-from extensions import db, socketio, login_manager
+from extensions import db, socketio, login_manager, message_keyring, cpu_pool
 from flask_socketio import emit, join_room
 from flask_login import login_user, logout_user
 from translation_service import TranslationServiceClient
-from sqlalchemy import or_
+from translation_cache import TranslationCache, CachedTranslationClient
+from translation_memory import TranslationMemory, MemoryTranslationClient
+from profiles import ProfileCache
+from passwords import PasswordHasher
+from search import MessageIndex
+from jobs import TranslationJobs, JOB_PENDING, JOB_RUNNING
+from admission import AdmissionControl, Overloaded, ACCEPT, DEFER
+from ratelimit import RateLimiter
+from language import detect_language, same_language
+from pagination import keyset_page, InvalidCursor, encode_sync_cursor, decode_sync_cursor
+from timing import span, timed
+from engines import read_replica
+from sqlalchemy import or_, and_, insert, select, case, func, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased, joinedload
+from datetime import datetime, timezone
+import json
+
+translation_cache = TranslationCache()
+translation_memory = TranslationMemory()
+# Whole-message cache, then sentence-level memory, then the model
+translation_client = CachedTranslationClient(
+    MemoryTranslationClient(TranslationServiceClient(), translation_memory), translation_cache
+)
+profile_cache = ProfileCache()
+passwords = PasswordHasher(cpu_pool)
+rate_limiter = RateLimiter()
+admission = AdmissionControl(translation_client)
+message_index = MessageIndex()
+translation_jobs = TranslationJobs(translation_client, admission=admission, index=message_index)
+
+def translation_target(profile):
+    # (language, dialect) a user reads messages in
+    language = profile.get('language') if profile else None
+    dialect = profile.get('dialect') if profile else None
+    return language or current_app.config['TRANSLATION_DEFAULT_LANGUAGE'], dialect or ''
+
+def recipient_targets(recipient_ids):
+    # Recipients grouped by (language, dialect): each group costs one translation
+    targets = {}
+    for recipient_id in recipient_ids:
+        targets.setdefault(translation_target(profile_cache.get(recipient_id)), []).append(recipient_id)
+    return targets
+
+def source_language_of(content, sender_id):
+    # Detected locally; short or ambiguous messages are assumed to be in the sender's language
+    if not current_app.config['TRANSLATION_DETECT_LANGUAGE']:
+        return ''
+    with span('detect'):
+        language = detect_language(content)
+    if not language:
+        profile = profile_cache.get(sender_id)
+        language = (profile.get('language') if profile else None) or ''
+    return language
+
+def too_many_requests(message, retry_after):
+    return {"message": message, "retry_after": retry_after}, 429, {'Retry-After': str(retry_after)}
+
+class InvalidMessage(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def message_receiver(receiver_id, content):
+    # The receiver's id as an int; raises InvalidMessage for bad input or an unknown receiver
+    if isinstance(receiver_id, str) and receiver_id.strip().isdigit():
+        receiver_id = int(receiver_id)
+    # bool is an int subclass, and True would otherwise stand for user 1
+    if not isinstance(receiver_id, int) or isinstance(receiver_id, bool):
+        raise InvalidMessage("receiver_id must be a user id")
+    if not isinstance(content, str) or not content:
+        raise InvalidMessage("content is required")
+    if profile_cache.get(receiver_id) is None:
+        raise InvalidMessage("User not found", 404)
+    return receiver_id
+
+def create_message(sender_id, receiver_id, content):
+    # Raises InvalidMessage for bad input, and Overloaded, before anything is
+    # written, when the message needs translating and admission control is
+    # shedding translation work
+    receiver_id = message_receiver(receiver_id, content)
+    message = Message(sender_id=sender_id, receiver_id=receiver_id)
+    message.source_language = source_language_of(content, sender_id)
+    targets = [
+        (target, recipients) for target, recipients in recipient_targets([receiver_id]).items()
+        if not same_language(message.source_language, target[0])
+    ]
+    decision = admission.admit() if targets else ACCEPT
+    # Nothing to wait for when every recipient reads the source language
+    message.translated = not targets
+    with span('encrypt'):
+        message.encrypt_content(content)
+    # Plaintext for the receive_message event and the response; only the ciphertext is stored
+    message.content = content
+    with span('db.commit'):
+        db.session.add(message)
+        db.session.flush()
+        message_index.add_messages([(message.id, sender_id, receiver_id, content)])
+        # Committed with the message, so the translation survives a crash from here on
+        job_ids = translation_jobs.enqueue([{
+            'message_id': message.id, 'source_language': message.source_language,
+            'language': language, 'dialect': dialect, 'recipients': recipients
+        } for (language, dialect), recipients in targets])
+        db.session.commit()
 
-translation_client = TranslationServiceClient()
+    if decision == DEFER:
+        # Committed jobs are due, the sweeper sends them once the queue has room
+        return message
+
+    app = current_app._get_current_object()
+    for job_id, (_, recipients) in zip(job_ids, targets):
+        if current_app.config['TRANSLATION_ASYNC']:
+            admission.spawn(translation_jobs.run, app, [job_id])
+            continue
+        translated_content = translation_jobs.run(app, [job_id], notify=False).get(job_id)
+        if receiver_id in recipients:
+            message.translated_content = translated_content
+            message.translated = translated_content is not None
+
+    return message
+
+def attach_translations(messages, user_id):
+    # Sets translated_content on each (decrypted) message to its text in the
+    # user's language: the stored translation, preferring the user's dialect,
+    # or the message itself when it was written in that language.
+    language, dialect = translation_target(profile_cache.get(user_id))
+    found = {}
+    if messages:
+        with span('db.query'):
+            rows = db.session.query(
+                MessageTranslation.message_id, MessageTranslation.dialect, MessageTranslation.content
+            ).filter(
+                MessageTranslation.message_id.in_([message.id for message in messages]),
+                MessageTranslation.language == language
+            ).all()
+        for message_id, row_dialect, content in rows:
+            if message_id not in found or row_dialect == dialect:
+                found[message_id] = content
+
+    for message in messages:
+        if message.id in found:
+            message.translated_content = found[message.id]
+        elif same_language(message.source_language, language):
+            message.translated_content = message.content
+        else:
+            message.translated_content = None
+    return messages
+
+def stored_sync_cursor(user_id):
+    # The cursor the user's last sync ended at; a first sync starts at the newest message
+    stored = db.session.get(DeliveryCursor, user_id)
+    if stored is not None:
+        return stored.message_id, stored.translation_id, stored.pending_from
+    newest = db.session.scalar(select(func.max(Message.id))) or 0
+    return newest, db.session.scalar(select(func.max(MessageTranslation.id))) or 0, newest + 1
+
+def sync_delta(user_id, cursor, limit):
+    # What the user missed since cursor, across all conversations: messages
+    # either way after its message id, oldest first, and translations stored
+    # since for received messages that were still being translated. Returns
+    # (messages, translations, next cursor, whether more messages are waiting).
+    after, seen_translation, pending_from = cursor
+    language, dialect = translation_target(profile_cache.get(user_id))
+
+    with span('db.query'):
+        # Read before the translations, so one stored meanwhile is reported by the next sync
+        still_pending = db.session.scalar(select(func.min(Message.id)).where(
+            Message.receiver_id == user_id, Message.id >= pending_from, Message.translated.is_(False),
+            select(TranslationJob.id).where(
+                TranslationJob.message_id == Message.id, TranslationJob.state.in_((JOB_PENDING, JOB_RUNNING))
+            ).exists()
+        ))
+        newest_translation = max(seen_translation, db.session.scalar(select(func.max(MessageTranslation.id))) or 0)
+
+        # One statement: a range scan per direction, each stopping after limit + 1 rows
+        ids = union_all(*(
+            select(Message.id).where(column == user_id, Message.id > after)
+            .order_by(Message.id).limit(limit + 1).subquery().select()
+            for column in (Message.receiver_id, Message.sender_id)
+        ))
+        messages = Message.query.filter(Message.id.in_(ids)).order_by(Message.id).limit(limit + 1).all()
+    more = len(messages) > limit
+    messages = messages[:limit]
+    with span('decrypt'):
+        Message.decrypt_many(messages)
+    attach_translations(messages, user_id)
+    newest = messages[-1].id if messages else after
+
+    found = {}
+    if pending_from <= after:
+        with span('db.query'):
+            rows = db.session.query(
+                MessageTranslation.message_id, MessageTranslation.dialect, MessageTranslation.content
+            ).join(Message, Message.id == MessageTranslation.message_id).filter(
+                Message.receiver_id == user_id, Message.id.between(pending_from, after),
+                MessageTranslation.language == language,
+                MessageTranslation.id > seen_translation, MessageTranslation.id <= newest_translation
+            ).all()
+        for message_id, row_dialect, content in rows:
+            if message_id not in found or row_dialect == dialect:
+                found[message_id] = (row_dialect, content)
+    translations = [
+        {'id': message_id, 'translated': True, 'translated_content': content,
+         'language': language, 'dialect': row_dialect}
+        for message_id, (row_dialect, content) in sorted(found.items())
+    ]
+
+    # Dead jobs do not hold the cursor back, their messages stay untranslated
+    pending = [message.id for message in messages
+               if message.receiver_id == user_id and message.translated_content is None]
+    if still_pending is not None:
+        pending.append(still_pending)
+    return messages, translations, (newest, newest_translation, min(pending, default=newest + 1)), more
+
+def sync_messages(user_id, since, limit):
+    # Raises InvalidCursor for a malformed since. Without since, continues from
+    # the cursor stored by the user's last sync on any device.
+    cursor = decode_sync_cursor(since) if since else stored_sync_cursor(user_id)
+    messages, translations, cursor, more = sync_delta(user_id, cursor, limit)
+    # Dumped before the commit expires the messages, which would reload them one by one
+    delta = {
+        "messages": messages_schema.dump(messages),
+        "translations": translations,
+        "cursor": encode_sync_cursor(*cursor),
+        "more": more
+    }
+
+    message_id, translation_id, pending_from = cursor
+    db.session.merge(DeliveryCursor(
+        user_id=user_id, message_id=message_id, translation_id=translation_id, pending_from=pending_from
+    ))
+    try:
+        with span('db.commit'):
+            db.session.commit()
+    except IntegrityError:
+        # Another sync for the user stored the first cursor at the same time
+        db.session.rollback()
+    return delta
+
+def create_messages(sender_id, items):
+    # Validates every item and inserts the valid ones with a single multi-row
+    # INSERT ... RETURNING and one commit. Returns per-item results in input order.
+    results = [None] * len(items)
+    # bool is an int subclass, and True would otherwise stand for user 1
+    receiver_ids = {
+        item.get('receiver_id') for item in items
+        if isinstance(item, dict) and isinstance(item.get('receiver_id'), int)
+        and not isinstance(item.get('receiver_id'), bool)
+    }
+    known_receivers = {
+        user_id: (language or current_app.config['TRANSLATION_DEFAULT_LANGUAGE'], dialect or '')
+        for user_id, language, dialect in db.session.query(User.id, User.language, User.dialect).filter(User.id.in_(
+            list(receiver_ids)
+        ))
+    }
+
+    rows = []
+    row_indexes = []
+    now = datetime.utcnow()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = {'index': index, 'status': 'error', 'message': 'Item must be an object'}
+            continue
+        receiver_id = item.get('receiver_id')
+        content = item.get('content')
+        if not isinstance(content, str) or not content:
+            results[index] = {'index': index, 'status': 'error', 'message': 'content is required'}
+            continue
+        if isinstance(receiver_id, bool) or receiver_id not in known_receivers:
+            results[index] = {'index': index, 'status': 'error', 'message': 'Unknown receiver_id'}
+            continue
+        try:
+            timestamp = datetime.fromisoformat(item['timestamp']) if item.get('timestamp') else now
+        except (TypeError, ValueError):
+            results[index] = {'index': index, 'status': 'error', 'message': 'Invalid timestamp'}
+            continue
+        if timestamp.tzinfo is not None:
+            # Stored as naive UTC like utcnow(), so history and sync keep their order
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+        source_language = source_language_of(content, sender_id)
+        low, high = conversation_key(sender_id, receiver_id)
+        rows.append({
+            'sender_id': sender_id,
+            'receiver_id': receiver_id,
+            'conversation_low': low,
+            'conversation_high': high,
+            'timestamp': timestamp,
+            'source_language': source_language,
+            'translated': same_language(source_language, known_receivers[receiver_id][0])
+        })
+        row_indexes.append(index)
+
+    created = []
+    if rows:
+        # One offloaded pass over the whole batch instead of a cipher call per item on the hub
+        with span('encrypt'):
+            encryption_key_id, tokens = message_keyring.encrypt_many([items[index]['content'] for index in row_indexes])
+        for row, token in zip(rows, tokens):
+            row['content_encrypted'] = token
+            row['encryption_key_id'] = encryption_key_id
+        with span('db.insert'):
+            ids = db.session.scalars(
+                insert(Message).returning(Message.id, sort_by_parameter_order=True), rows
+            ).all()
+            message_index.add_messages([
+                (message_id, sender_id, row['receiver_id'], items[index]['content'])
+                for index, message_id, row in zip(row_indexes, ids, rows)
+            ])
+            # Jobs commit with their messages; one per message that needs translating
+            job_ids = iter(translation_jobs.enqueue([
+                {'message_id': message_id, 'source_language': row['source_language'],
+                 'language': known_receivers[row['receiver_id']][0],
+                 'dialect': known_receivers[row['receiver_id']][1], 'recipients': [row['receiver_id']]}
+                for message_id, row in zip(ids, rows) if not row['translated']
+            ]))
+            db.session.commit()
+
+        for index, message_id, row in zip(row_indexes, ids, rows):
+            results[index] = {'index': index, 'status': 'created', 'id': message_id}
+            created.append({
+                'id': message_id,
+                'sender_id': sender_id,
+                'receiver_id': row['receiver_id'],
+                'timestamp': row['timestamp'],
+                'source_language': row['source_language'],
+                'translated': row['translated'],
+                'content': items[index]['content'],
+                'job_id': None if row['translated'] else next(job_ids)
+            })
+
+    return results, created
+
+def translate_messages(app, created):
+    # Runs the jobs of a bulk send: one translate_many per distinct (source
+    # language, language, dialect). Messages already in their receiver's
+    # language come back unchanged, failed ones as None until a retry succeeds.
+    job_ids = [message['job_id'] for message in created if message['job_id'] is not None]
+    results = translation_jobs.run(app, job_ids) if job_ids else {}
+    return [
+        message['content'] if message['job_id'] is None else results.get(message['job_id'])
+        for message in created
+    ]
+
+def send_bulk_messages(sender_id, items):
+    results, created = create_messages(sender_id, items)
+    with span('emit'):
+        for message in created:
+            socketio.emit('receive_message', message_schema.dump(message), room=str(message['receiver_id']))
+    return results, created
+
+def message_preview(message, length):
+    content = message.content
+    translated = message.translated_content
+    return {
+        'id': message.id,
+        'sender_id': message.sender_id,
+        'timestamp': message.timestamp.isoformat() if message.timestamp else None,
+        'preview': content[:length] if content is not None else None,
+        'translated_preview': translated[:length] if translated is not None else None
+    }
+
+def contacts_overview(user_id, include_last_message=True, include_unread=True):
+    # Three queries however many contacts there are: contacts joined with
+    # their profiles, the newest message of every conversation, and unread
+    # counts as a single GROUP BY.
+    with span('db.query'):
+        contacts = Contact.query.options(joinedload(Contact.contact)).filter_by(owner_id=user_id).all()
+
+    last_messages = {}
+    if include_last_message and contacts:
+        # One correlated index lookup per contact on ix_message_conversation
+        newest = aliased(Message)
+        low = case((Contact.contact_id < user_id, Contact.contact_id), else_=user_id)
+        high = case((Contact.contact_id < user_id, user_id), else_=Contact.contact_id)
+        newest_id = select(newest.id).where(
+            newest.conversation_low == low, newest.conversation_high == high
+        ).order_by(newest.timestamp.desc(), newest.id.desc()).limit(1).correlate(Contact).scalar_subquery()
+
+        with span('db.query'):
+            messages = Message.query.filter(
+                Message.id.in_(select(newest_id).where(Contact.owner_id == user_id))
+            ).all()
+        with span('decrypt'):
+            Message.decrypt_many(messages)
+        attach_translations(messages, user_id)
+        length = current_app.config['CONTACTS_PREVIEW_LENGTH']
+        for message in messages:
+            other_id = message.receiver_id if message.sender_id == user_id else message.sender_id
+            last_messages[other_id] = message_preview(message, length)
+
+    unread = {}
+    if include_unread and contacts:
+        with span('db.query'):
+            unread = dict(
+                db.session.query(Message.sender_id, func.count(Message.id))
+                .join(Contact, and_(Contact.owner_id == Message.receiver_id, Contact.contact_id == Message.sender_id))
+                .filter(Message.receiver_id == user_id, Message.id > func.coalesce(Contact.last_read_message_id, 0))
+                .group_by(Message.sender_id)
+                .all()
+            )
+
+    overview = []
+    for contact in contacts:
+        entry = {
+            'id': contact.id,
+            'contact_id': contact.contact_id,
+            'profile': user_schema.dump(contact.contact),
+            'last_read_message_id': contact.last_read_message_id
+        }
+        if include_last_message:
+            entry['last_message'] = last_messages.get(contact.contact_id)
+        if include_unread:
+            entry['unread'] = unread.get(contact.contact_id, 0)
+        overview.append(entry)
+
+    # Most recent conversation first, contacts without messages by username
+    overview.sort(key=lambda entry: entry['profile']['username'])
+    overview.sort(key=lambda entry: (entry.get('last_message') or {}).get('timestamp') or '', reverse=True)
+    return overview
 
 def register_routes(app, api):
     # Define API models
@@ -29,7 +446,9 @@ def register_routes(app, api):
 
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        # A detached User built from the cached profile, never added to the session
+        profile = profile_cache.get(int(user_id))
+        return User(**profile) if profile is not None else None
 
     # User Routes
     @api.route('/users')
@@ -48,7 +467,9 @@ def register_routes(app, api):
                 return {"message": "Username or email already exists"}, 400
 
             new_user = User(username=username, email=email)
-            new_user.set_password(password)
+            new_user.language = data.get('language') or new_user.language
+            new_user.dialect = data.get('dialect') or new_user.dialect
+            new_user.password_hash = passwords.hash(password)
             db.session.add(new_user)
             db.session.commit()
 
@@ -61,8 +482,10 @@ def register_routes(app, api):
         @jwt_required()
         def get(self, user_id):
             """Get a user by ID"""
-            user = User.query.get_or_404(user_id)
-            return user_schema.jsonify(user)
+            profile = profile_cache.get(user_id)
+            if profile is None:
+                return {"message": "User not found"}, 404
+            return profile
 
         @api.doc(security='jwt')
         @jwt_required()
@@ -82,6 +505,7 @@ def register_routes(app, api):
             user.location = data.get('location', user.location)
             user.profile_picture = data.get('profile_picture', user.profile_picture)
             db.session.commit()
+            profile_cache.invalidate(user.id)
             return user_schema.jsonify(user)
 
         @api.doc(security='jwt')
@@ -95,6 +519,7 @@ def register_routes(app, api):
 
             db.session.delete(user)
             db.session.commit()
+            profile_cache.invalidate(user_id)
             return {"message": "User deleted"}
 
     # Authentication Routes
@@ -110,8 +535,16 @@ def register_routes(app, api):
             username = data.get('username', '').strip()
             password = data.get('password', '').strip()
 
+            # Every attempt costs a full KDF unless it hits the credential cache
+            retry_after = rate_limiter.check('login')
+            if retry_after:
+                return too_many_requests("Too many login attempts", retry_after)
+
             user = User.query.filter_by(username=username).first()
-            if user and user.check_password(password):
+            if user and passwords.verify(user.id, user.password_hash, password):
+                if passwords.needs_rehash(user.password_hash):
+                    user.password_hash = passwords.hash(password)
+                    db.session.commit()
                 login_user(user)
                 access_token = create_access_token(identity=user.id)
                 return {"access_token": access_token}, 200
@@ -150,16 +583,56 @@ def register_routes(app, api):
             db.session.add(new_contact)
             db.session.commit()
 
-            return contact_schema.jsonify(new_contact), 201
+            return contact_schema.dump(new_contact), 201
 
         @api.doc(security='jwt')
         @jwt_required()
+        @read_replica
         def get(self):
             """Get all contacts for the current user"""
             user_id = get_jwt_identity()
             contacts = Contact.query.filter_by(owner_id=user_id).all()
             return contacts_schema.jsonify(contacts)
 
+    @api.route('/contacts/overview')
+    class ContactOverview(Resource):
+        @api.doc(security='jwt', params={
+            'last_message': 'Include a preview of the newest message (default true)',
+            'unread': 'Include the unread message count (default true)'
+        })
+        @jwt_required()
+        @read_replica
+        def get(self):
+            """Get every contact with profile, newest message and unread count in one request"""
+            def flag(name):
+                return request.args.get(name, 'true').lower() not in ('false', '0', 'no')
+
+            overview = contacts_overview(get_jwt_identity(), flag('last_message'), flag('unread'))
+            return {"contacts": overview}
+
+    @api.route('/contacts/<int:contact_id>/read')
+    class ContactRead(Resource):
+        @api.doc(security='jwt')
+        @jwt_required()
+        def post(self, contact_id):
+            """Mark messages from a contact as read, up to message_id or the newest one"""
+            user_id = get_jwt_identity()
+            contact = Contact.query.filter_by(owner_id=user_id, contact_id=contact_id).first_or_404()
+
+            data = request.get_json(silent=True) or {}
+            message_id = data.get('message_id')
+            if message_id is None:
+                message_id = db.session.query(func.max(Message.id)) \
+                    .filter_by(receiver_id=user_id, sender_id=contact_id).scalar()
+            elif not isinstance(message_id, int):
+                return {"message": "message_id must be an integer"}, 400
+
+            # The read position only moves forward
+            if message_id is not None and message_id > (contact.last_read_message_id or 0):
+                contact.last_read_message_id = message_id
+                db.session.commit()
+            return {"contact_id": contact_id, "last_read_message_id": contact.last_read_message_id}
+
     @api.route('/contacts/<int:contact_id>')
     class ContactDetail(Resource):
         @api.doc(security='jwt')
@@ -180,43 +653,178 @@ def register_routes(app, api):
         @jwt_required()
         def post(self):
             """Create a new message"""
-            data = request.get_json()
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                return {"message": "Request body must be a JSON object"}, 400
             sender_id = get_jwt_identity()
             receiver_id = data.get('receiver_id')
             content = data.get('content')
 
-            message = Message(sender_id=sender_id, receiver_id=receiver_id)
-            message.encrypt_content(content)
-            db.session.add(message)
-            db.session.commit()
-
-            translated_content = translation_client.translate(content, 'en')
-            message.translated_content = translated_content
-            message.translated = True
-            db.session.commit()
+            retry_after = rate_limiter.check('messages', sender_id)
+            if retry_after:
+                return too_many_requests("Too many messages", retry_after)
+            try:
+                message = create_message(sender_id, receiver_id, content)
+            except InvalidMessage as error:
+                return {"message": str(error)}, error.status
+            except Overloaded as error:
+                return too_many_requests(str(error), error.retry_after)
 
-            socketio.emit('receive_message', message_schema.dump(message), room=str(receiver_id))
+            with span('emit'):
+                socketio.emit('receive_message', message_schema.dump(message), room=str(message.receiver_id))
 
-            return message_schema.jsonify(message), 201
+            return message_schema.dump(message), 201
 
         @api.doc(security='jwt')
         @jwt_required()
+        @read_replica
         def get(self):
-            """Get messages for a specific contact"""
+            """Get a page of messages with a contact, newest page first (cursor: before/after, limit)"""
             user_id = get_jwt_identity()
             contact_id = request.args.get('contact_id', type=int)
             if not contact_id:
                 return {"message": "Contact ID required"}, 400
 
-            messages = Message.query.filter(
-                ((Message.sender_id == user_id) & (Message.receiver_id == contact_id)) |
-                ((Message.sender_id == contact_id) & (Message.receiver_id == user_id))
-            ).order_by(Message.timestamp.asc()).all()
+            limit = min(
+                request.args.get('limit', current_app.config['MESSAGES_PAGE_SIZE'], type=int),
+                current_app.config['MESSAGES_MAX_PAGE_SIZE']
+            )
+            if limit < 1:
+                return {"message": "limit must be positive"}, 400
+
+            low, high = conversation_key(user_id, contact_id)
+            query = Message.query.filter_by(conversation_low=low, conversation_high=high)
+            try:
+                with span('db.query'):
+                    page = keyset_page(
+                        query, Message.timestamp, Message.id, limit,
+                        before=request.args.get('before'), after=request.args.get('after')
+                    )
+            except InvalidCursor as error:
+                return {"message": str(error)}, 400
+
+            with span('decrypt'):
+                Message.decrypt_many(page['items'])
+            attach_translations(page['items'], user_id)
+
+            return {
+                "messages": messages_schema.dump(page['items']),
+                "before": page['before'],
+                "after": page['after']
+            }
+
+    @api.route('/messages/bulk')
+    class MessageBulk(Resource):
+        @api.doc(security='jwt')
+        @jwt_required()
+        def post(self):
+            """Create many messages in one request ({"messages": [{receiver_id, content, timestamp?}]})
 
-            for msg in messages:
-                msg.content = msg.decrypt_content()
+            Send 'Accept: application/x-ndjson' to stream one line per created item
+            followed by one line per translation instead of translating in the background.
+            """
+            data = request.get_json()
+            items = data.get('messages') if isinstance(data, dict) else None
+            if not isinstance(items, list) or not items:
+                return {"message": "messages must be a non-empty list"}, 400
+            if len(items) > current_app.config['MESSAGES_BULK_MAX_ITEMS']:
+                return {"message": f"At most {current_app.config['MESSAGES_BULK_MAX_ITEMS']} messages per request"}, 400
 
-            return messages_schema.jsonify(messages)
+            sender_id = get_jwt_identity()
+            retry_after = rate_limiter.check('bulk', sender_id, cost=len(items))
+            if retry_after:
+                return too_many_requests("Too many messages", retry_after)
+            try:
+                decision = admission.admit()
+            except Overloaded as error:
+                return too_many_requests(str(error), error.retry_after)
+
+            results, created = send_bulk_messages(sender_id, items)
+            app = current_app._get_current_object()
+
+            if request.accept_mimetypes.best == 'application/x-ndjson':
+                def generate():
+                    for result in results:
+                        yield json.dumps(result) + '\n'
+                    if created and decision == DEFER:
+                        for message in created:
+                            yield json.dumps({'id': message['id'], 'status': 'deferred'}) + '\n'
+                    elif created:
+                        translations = translate_messages(app, created)
+                        for message, translated in zip(created, translations):
+                            yield json.dumps({
+                                'id': message['id'],
+                                'status': 'translated' if translated is not None else 'translation_failed',
+                                'translated_content': translated
+                            }) + '\n'
+                return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+            if created and decision != DEFER:
+                admission.spawn(translate_messages, app, created)
+            return {"results": results}, 201
+
+    @api.route('/messages/search')
+    class MessageSearch(Resource):
+        @api.doc(security='jwt')
+        @jwt_required()
+        @read_replica
+        def get(self):
+            """Search the user's messages and their translations, best match first (q, contact_id, limit, after)"""
+            user_id = get_jwt_identity()
+            text = request.args.get('q', '').strip()
+            if not text:
+                return {"message": "q is required"}, 400
+            limit = min(
+                request.args.get('limit', current_app.config['SEARCH_PAGE_SIZE'], type=int),
+                current_app.config['SEARCH_MAX_PAGE_SIZE']
+            )
+            if limit < 1:
+                return {"message": "limit must be positive"}, 400
+
+            try:
+                matches, after = message_index.search(
+                    user_id, text, limit,
+                    contact_id=request.args.get('contact_id', type=int), after=request.args.get('after')
+                )
+            except InvalidCursor as error:
+                return {"message": str(error)}, 400
+
+            scores = dict(matches)
+            with span('db.query'):
+                # The index only narrows the search; what the user may read is decided here
+                messages = Message.query.filter(
+                    Message.id.in_(scores), or_(Message.sender_id == user_id, Message.receiver_id == user_id)
+                ).all() if scores else []
+            messages.sort(key=lambda message: (scores[message.id], message.id), reverse=True)
+            with span('decrypt'):
+                Message.decrypt_many(messages)
+            attach_translations(messages, user_id)
+
+            results = messages_schema.dump(messages)
+            for result in results:
+                result['score'] = scores[result['id']]
+            return {"messages": results, "after": after}
+
+    @api.route('/sync')
+    class Sync(Resource):
+        @api.doc(security='jwt')
+        @jwt_required()
+        def get(self):
+            """Messages and translations missed since a sync cursor, across all conversations (since, limit)
+
+            Pass the returned cursor as 'since' next time, immediately while 'more' is true.
+            Without 'since' the sync continues from where the user's last one ended.
+            """
+            limit = min(
+                request.args.get('limit', current_app.config['SYNC_MAX_MESSAGES'], type=int),
+                current_app.config['SYNC_MAX_MESSAGES']
+            )
+            if limit < 1:
+                return {"message": "limit must be positive"}, 400
+            try:
+                return sync_messages(get_jwt_identity(), request.args.get('since'), limit)
+            except InvalidCursor as error:
+                return {"message": str(error)}, 400
 
     @api.route('/messages/<int:message_id>')
     class MessageDetail(Resource):
@@ -224,8 +832,13 @@ def register_routes(app, api):
         @jwt_required()
         def get(self, message_id):
             """Get a specific message"""
+            user_id = get_jwt_identity()
             message = Message.query.get_or_404(message_id)
+            # Someone else's message is reported as missing, not just forbidden
+            if user_id not in (message.sender_id, message.receiver_id):
+                return {"message": "Message not found"}, 404
             message.content = message.decrypt_content()
+            attach_translations([message], user_id)
             return message_schema.jsonify(message)
 
         @api.doc(security='jwt')
@@ -249,9 +862,10 @@ def register_routes(app, api):
         @jwt_required()
         def get(self):
             """Get user settings"""
-            user_id = get_jwt_identity()
-            user = User.query.get_or_404(user_id)
-            return user_schema.jsonify(user)
+            profile = profile_cache.get(get_jwt_identity())
+            if profile is None:
+                return {"message": "User not found"}, 404
+            return profile
 
         @api.doc(security='jwt')
         @jwt_required()
@@ -267,6 +881,7 @@ def register_routes(app, api):
             user.location = data.get('location', user.location)
             user.profile_picture = data.get('profile_picture', user.profile_picture)
             db.session.commit()
+            profile_cache.invalidate(user.id)
             return user_schema.jsonify(user)
 
     # SocketIO Events
@@ -277,24 +892,75 @@ def register_routes(app, api):
         join_room(str(user_id))
         emit('status', {'message': f'User {user_id} has joined the room.'}, room=str(user_id))
 
+    @socketio.on('sync')
+    @timed('socket.sync')
+    @jwt_required()
+    def handle_sync(data=None):
+        # Sent by clients after (re)connecting; the delta is the acknowledgement
+        data = data or {}
+        limit = data.get('limit') or current_app.config['SYNC_MAX_MESSAGES']
+        if not isinstance(limit, int) or limit < 1:
+            return {"message": "limit must be positive"}
+        try:
+            return sync_messages(
+                get_jwt_identity(), data.get('since'), min(limit, current_app.config['SYNC_MAX_MESSAGES'])
+            )
+        except InvalidCursor as error:
+            return {"message": str(error)}
+
     @socketio.on('send_message')
+    @timed('socket.send_message')
     @jwt_required()
     def handle_send_message(data):
         sender_id = get_jwt_identity()
-        receiver_id = data.get('receiver_id')
-        content = data.get('content')
-
-        message = Message(sender_id=sender_id, receiver_id=receiver_id)
-        message.encrypt_content(content)
-        db.session.add(message)
-        db.session.commit()
-
-        translated_content = translation_client.translate(content, 'en')
-        message.translated_content = translated_content
-        message.translated = True
-        db.session.commit()
+        receiver_id = data.get('receiver_id') if isinstance(data, dict) else None
+        content = data.get('content') if isinstance(data, dict) else None
+
+        retry_after = rate_limiter.check('messages', sender_id)
+        reason = 'rate_limited'
+        if not retry_after:
+            try:
+                message = create_message(sender_id, receiver_id, content)
+            except InvalidMessage as error:
+                # To the sender only, and as the event's acknowledgement
+                rejected = {'reason': 'invalid', 'message': str(error), 'receiver_id': receiver_id}
+                emit('message_rejected', rejected)
+                return rejected
+            except Overloaded as error:
+                retry_after, reason = error.retry_after, 'overloaded'
+        if retry_after:
+            # To the sender only, and as the event's acknowledgement
+            rejected = {'reason': reason, 'retry_after': retry_after, 'receiver_id': receiver_id}
+            emit('message_rejected', rejected)
+            return rejected
+
+        with span('emit'):
+            emit('receive_message', message_schema.dump(message), room=str(message.receiver_id))
+
+    @socketio.on('send_messages')
+    @timed('socket.send_messages')
+    @jwt_required()
+    def handle_send_messages(data):
+        items = data.get('messages') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            return {"message": "messages must be a non-empty list"}
+        if len(items) > current_app.config['MESSAGES_BULK_MAX_ITEMS']:
+            return {"message": f"At most {current_app.config['MESSAGES_BULK_MAX_ITEMS']} messages per request"}
 
-        emit('receive_message', message_schema.dump(message), room=str(receiver_id))
+        sender_id = get_jwt_identity()
+        retry_after = rate_limiter.check('bulk', sender_id, cost=len(items))
+        if retry_after:
+            return {"message": "Too many messages", "reason": 'rate_limited', "retry_after": retry_after}
+        try:
+            decision = admission.admit()
+        except Overloaded as error:
+            return {"message": str(error), "reason": 'overloaded', "retry_after": error.retry_after}
+
+        results, created = send_bulk_messages(sender_id, items)
+        if created and decision != DEFER:
+            admission.spawn(translate_messages, current_app._get_current_object(), created)
+        # Returned to the client as the event's acknowledgement
+        return {"results": results}
 
     # Add resources to API
     api.add_resource(UserResource, '/api/users')
@@ -302,7 +968,12 @@ def register_routes(app, api):
     api.add_resource(Login, '/api/login')
     api.add_resource(Logout, '/api/logout')
     api.add_resource(ContactList, '/api/contacts')
+    api.add_resource(ContactOverview, '/api/contacts/overview')
+    api.add_resource(ContactRead, '/api/contacts/<int:contact_id>/read')
     api.add_resource(ContactDetail, '/api/contacts/<int:contact_id>')
     api.add_resource(MessageList, '/api/messages')
+    api.add_resource(MessageBulk, '/api/messages/bulk')
+    api.add_resource(MessageSearch, '/api/messages/search')
     api.add_resource(MessageDetail, '/api/messages/<int:message_id>')
+    api.add_resource(Sync, '/api/sync')
     api.add_resource(UserSettings, '/api/settings')
\ No newline at end of file
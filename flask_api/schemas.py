@@ -1,7 +1,8 @@
-from marshmallow import Schema, fields
+from marshmallow import fields
+from extensions import ma
 from models import User, Message, Contact
 
-class UserSchema(Schema):
+class UserSchema(ma.Schema):
     id = fields.Int(dump_only=True)
     username = fields.Str(required=True)
     email = fields.Email(required=True)
@@ -10,18 +11,20 @@ class UserSchema(Schema):
     location = fields.Str()
     profile_picture = fields.Str()
 
-class ContactSchema(Schema):
+class ContactSchema(ma.Schema):
     id = fields.Int(dump_only=True)
     owner_id = fields.Int(required=True)
     contact_id = fields.Int(required=True)
 
-class MessageSchema(Schema):
+class MessageSchema(ma.Schema):
     id = fields.Int(dump_only=True)
     sender_id = fields.Int(required=True)
     receiver_id = fields.Int(required=True)
     content = fields.Str(required=True)  # We'll handle encryption/decryption in the model
     timestamp = fields.DateTime(dump_only=True)
+    source_language = fields.Str(dump_only=True)
     translated = fields.Boolean()
+    # The message in the reading user's language and dialect, when it has one
     translated_content = fields.Str()
 
 
@@ -0,0 +1,156 @@
+import re
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, bindparam, cast, column, delete, func, literal_column, or_, select, table
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+from extensions import db
+from models import Message, MessageTranslation, SearchDocument, User
+from pagination import encode_search_cursor, decode_search_cursor
+from timing import span
+
+# One index holds every language, so no stemming or stop words
+TEXT_CONFIG = 'simple'
+
+documents = SearchDocument.__table__
+fts = table('message_search_fts', column('rowid'))
+
+def fts_query(text):
+    # Every word must appear; quoted, so FTS5 operators in user input are just words
+    return ' '.join('"' + word + '"' for word in re.findall(r'\w+', text))
+
+class MessageIndex:
+    # Full-text search over what each user can read: a document per message
+    # and participant, written with the message and extended with the
+    # translation into the reader's language when it is stored. PostgreSQL
+    # keeps tsvectors under a GIN index on (user_id, document); SQLite keeps
+    # the text under an FTS5 table. Both rank matches and page on (score, id).
+    def __init__(self, app=None):
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['MESSAGE_SEARCH']
+        app.extensions['message_index'] = self
+        app.cli.add_command(search_cli)
+
+    def postgres(self):
+        return db.engine.dialect.name == 'postgresql'
+
+    def document(self, name):
+        if self.postgres():
+            return func.to_tsvector(TEXT_CONFIG, bindparam(name))
+        return bindparam(name)
+
+    def add_messages(self, messages):
+        # (message id, sender id, receiver id, plain text) tuples, in the caller's transaction
+        if not self.enabled or not messages:
+            return
+        rows = [
+            {'b_user_id': user_id, 'b_contact_id': contact_id, 'b_message_id': message_id, 'b_text': content}
+            for message_id, sender_id, receiver_id, content in messages
+            for user_id, contact_id in {(sender_id, receiver_id), (receiver_id, sender_id)}
+        ]
+        with span('search.index'):
+            db.session.execute(documents.insert().values(
+                user_id=bindparam('b_user_id'), contact_id=bindparam('b_contact_id'),
+                message_id=bindparam('b_message_id'), document=self.document('b_text')
+            ), rows)
+
+    def add_translations(self, translations):
+        # (message id, reader ids, translated text) tuples, in the caller's transaction
+        if not self.enabled or not translations:
+            return
+        # tsvector || tsvector on PostgreSQL, text concatenation on SQLite
+        separator = '' if self.postgres() else '\n'
+        rows = [
+            {'b_message_id': message_id, 'b_user_id': user_id, 'b_text': separator + content}
+            for message_id, readers, content in translations
+            for user_id in readers
+        ]
+        with span('search.index'):
+            db.session.execute(documents.update().where(
+                documents.c.message_id == bindparam('b_message_id'), documents.c.user_id == bindparam('b_user_id')
+            ).values(document=documents.c.document.op('||')(self.document('b_text'))), rows)
+
+    def search(self, user_id, text, limit, contact_id=None, after=None):
+        # Best matches first as (message id, score) pairs, and the cursor of the
+        # next page (None on the last). Raises InvalidCursor for a malformed after.
+        if self.postgres():
+            query = func.websearch_to_tsquery(TEXT_CONFIG, text)
+            # ts_rank is a real; as a double it survives the cursor's round trip
+            # exactly, so the next page's score = :last comparison holds
+            score = cast(func.ts_rank(documents.c.document, query), DOUBLE_PRECISION)
+            matches = select(documents.c.message_id, score.label('score')).where(
+                documents.c.user_id == user_id, documents.c.document.op('@@')(query)
+            )
+        else:
+            text = fts_query(text)
+            # bm25 is lower for better matches
+            score = -func.bm25(literal_column('message_search_fts'))
+            matches = select(documents.c.message_id, score.label('score')).select_from(
+                documents.join(fts, fts.c.rowid == documents.c.id)
+            ).where(literal_column('message_search_fts').op('MATCH')(text), documents.c.user_id == user_id)
+        if not text.strip():
+            return [], None
+        if contact_id is not None:
+            matches = matches.where(documents.c.contact_id == contact_id)
+
+        ranked = matches.subquery()
+        page = select(ranked.c.message_id, ranked.c.score)
+        if after is not None:
+            last_score, last_id = decode_search_cursor(after)
+            page = page.where(or_(
+                ranked.c.score < last_score,
+                and_(ranked.c.score == last_score, ranked.c.message_id < last_id)
+            ))
+        with span('search.query'):
+            rows = db.session.execute(
+                page.order_by(ranked.c.score.desc(), ranked.c.message_id.desc()).limit(limit + 1)
+            ).all()
+        more = len(rows) > limit
+        rows = [(message_id, score) for message_id, score in rows[:limit]]
+        return rows, encode_search_cursor(rows[-1][1], rows[-1][0]) if more else None
+
+    def reindex(self, batch_size):
+        # Rebuilds every document from the messages and their stored
+        # translations, e.g. for history written before search existed
+        db.session.execute(delete(SearchDocument))
+        last_id = 0
+        indexed = 0
+        while True:
+            messages = Message.query.filter(Message.id > last_id).order_by(Message.id).limit(batch_size).all()
+            if not messages:
+                break
+            Message.decrypt_many(messages)
+            self.add_messages([
+                (message.id, message.sender_id, message.receiver_id, message.content) for message in messages
+            ])
+            # Translations the receiver reads: stored in the receiver's language
+            rows = db.session.query(
+                MessageTranslation.message_id, Message.receiver_id, MessageTranslation.content
+            ).join(Message, Message.id == MessageTranslation.message_id).join(
+                User, User.id == Message.receiver_id
+            ).filter(
+                MessageTranslation.message_id.in_([message.id for message in messages]),
+                MessageTranslation.language == func.coalesce(
+                    func.nullif(User.language, ''), current_app.config['TRANSLATION_DEFAULT_LANGUAGE']
+                )
+            ).all()
+            self.add_translations([(message_id, [receiver_id], content) for message_id, receiver_id, content in rows])
+            db.session.commit()
+            indexed += len(messages)
+            last_id = messages[-1].id
+        db.session.commit()
+        return indexed
+
+
+search_cli = AppGroup('search', help='Maintain the message search index.')
+
+@search_cli.command('reindex')
+@click.option('--batch-size', type=int, default=1000)
+def reindex_command(batch_size):
+    """Rebuild the search index from every stored message."""
+    indexed = current_app.extensions['message_index'].reindex(batch_size)
+    click.echo(f'Indexed {indexed} message(s)')
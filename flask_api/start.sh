@@ -0,0 +1,14 @@
+#!/bin/bash
+# Starts FLASK_WORKERS single-worker gunicorn processes on consecutive ports
+# from FLASK_BASE_PORT; keep nginx.conf's upstream in sync. Socket.IO events
+# are shared between them through SOCKETIO_MESSAGE_QUEUE.
+workers=${FLASK_WORKERS:-4}
+base_port=${FLASK_BASE_PORT:-5001}
+
+for ((i = 0; i < workers; i++)); do
+    GUNICORN_BIND="0.0.0.0:$((base_port + i))" gunicorn -c gunicorn.conf.py wsgi:app &
+done
+
+# Exit as soon as one worker dies so the container gets restarted
+wait -n
+exit $?
@@ -0,0 +1,83 @@
+import cProfile
+import functools
+import logging
+import os
+import signal
+import time
+
+# Callables taking (stage name, seconds). With no sinks registered a span
+# costs one attribute store and one list truthiness check.
+sinks = []
+
+def add_sink(sink):
+    sinks.append(sink)
+
+def remove_sink(sink):
+    if sink in sinks:
+        sinks.remove(sink)
+
+class span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter() if sinks else None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.start is not None:
+            elapsed = time.perf_counter() - self.start
+            for sink in sinks:
+                sink(self.name, elapsed)
+        return False
+
+def timed(name):
+    # Decorator form of span, for whole handlers
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class Profiler:
+    # cProfile switched on and off at runtime (kill -USR2 <pid>), nothing is
+    # hooked while it is off. It profiles the thread that toggles it, which
+    # under eventlet is the one running every greenlet.
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.profile = None
+
+    @property
+    def running(self):
+        return self.profile is not None
+
+    def start(self):
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            logging.info(f"Profiling {self.name} (pid {os.getpid()})")
+
+    def stop(self):
+        if self.profile is None:
+            return None
+        profile, self.profile = self.profile, None
+        profile.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{self.name}-{os.getpid()}-{int(time.time())}.prof')
+        profile.dump_stats(path)
+        logging.info(f"Wrote profile to {path}")
+        return path
+
+    def toggle(self, *_):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def install_signal(self, signum=signal.SIGUSR2):
+        signal.signal(signum, self.toggle)
@@ -0,0 +1,252 @@
+import hashlib
+import logging
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, update, func
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import TranslationCacheEntry
+from translation_service import PRIORITY_INTERACTIVE, PRIORITY_BULK
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Part of every key; bump it when normalize_text changes so old entries stop matching
+KEY_VERSION = '2'
+
+def normalize_text(text):
+    # "Thanks!" and " Thanks! " are the same chat message. Case is kept:
+    # "US" and "us", or "May" and "may", translate differently.
+    text = unicodedata.normalize('NFKC', text)
+    return ' '.join(text.split())
+
+def cache_key(text, source_language, target_language, dialect, model):
+    parts = [KEY_VERSION, normalize_text(text), source_language or '', target_language or '', dialect or '', model or '']
+    return hashlib.sha256('\x1f'.join(parts).encode()).hexdigest()
+
+class LRUCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+class SQLCacheBackend:
+    # Uses short-lived engine connections rather than db.session so a lookup
+    # never pins a pooled connection while the caller waits on the broker.
+    PRUNE_EVERY = 1000
+
+    def __init__(self, app, ttl, maxsize):
+        self.app = app
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.writes = 0
+
+    def get(self, key):
+        with self.app.app_context(), db.engine.connect() as conn:
+            return conn.execute(
+                select(TranslationCacheEntry.translation).where(
+                    TranslationCacheEntry.key == key,
+                    TranslationCacheEntry.expires_at > datetime.utcnow()
+                )
+            ).scalar()
+
+    def set(self, key, value):
+        now = datetime.utcnow()
+        values = {'translation': value, 'created_at': now, 'expires_at': now + timedelta(seconds=self.ttl)}
+        table = TranslationCacheEntry.__table__
+        with self.app.app_context():
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(table.insert().values(key=key, **values))
+            except IntegrityError:
+                with db.engine.begin() as conn:
+                    conn.execute(update(table).where(table.c.key == key).values(**values))
+
+            self.writes += 1
+            if self.writes % self.PRUNE_EVERY == 0:
+                self.prune()
+
+    def prune(self):
+        table = TranslationCacheEntry.__table__
+        with db.engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.expires_at <= datetime.utcnow()))
+            excess = conn.execute(select(func.count()).select_from(table)).scalar() - self.maxsize
+            if excess > 0:
+                oldest = select(table.c.key).order_by(table.c.created_at).limit(excess)
+                conn.execute(delete(table).where(table.c.key.in_(oldest)))
+
+class RedisCacheBackend:
+    # Size is bounded by the server's maxmemory/allkeys-lru policy
+    def __init__(self, url, ttl):
+        if redis is None:
+            raise RuntimeError("TRANSLATION_CACHE_BACKEND=redis requires the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get('translation:' + key)
+        return value.decode() if value is not None else None
+
+    def set(self, key, value):
+        self.client.setex('translation:' + key, self.ttl, value)
+
+class TranslationCache:
+    def __init__(self, app=None):
+        self.local = None
+        self.shared = None
+        self.model = None
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        ttl = app.config['TRANSLATION_CACHE_TTL']
+        self.local = LRUCache(app.config['TRANSLATION_CACHE_SIZE'], ttl)
+        self.model = app.config['TRANSLATION_MODEL']
+
+        backend = app.config['TRANSLATION_CACHE_BACKEND']
+        if backend == 'sql':
+            self.shared = SQLCacheBackend(app, ttl, app.config['TRANSLATION_CACHE_SHARED_SIZE'])
+        elif backend == 'redis':
+            self.shared = RedisCacheBackend(app.config['REDIS_URL'], ttl)
+        elif backend:
+            raise ValueError(f"Unknown TRANSLATION_CACHE_BACKEND: {backend}")
+
+    def key(self, text, source_language, target_language, dialect):
+        return cache_key(text, source_language, target_language, dialect, self.model)
+
+    def get(self, key):
+        if self.local is None:
+            return None
+
+        value = self.local.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as error:
+                # A broken shared tier must never break translation
+                logging.warning(f"Shared translation cache lookup failed: {error}")
+                value = None
+            if value is not None:
+                self.shared_hits += 1
+                self.local.set(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        if self.local is None:
+            return
+
+        self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value)
+            except Exception as error:
+                logging.warning(f"Shared translation cache write failed: {error}")
+
+    def clear(self):
+        if self.local is not None:
+            self.local.clear()
+
+    def stats(self):
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            'size': len(self.local) if self.local is not None else 0
+        }
+
+class CachedTranslationClient:
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+
+    def translate(self, text, target_language, source_language='', dialect='', timeout=None,
+                  priority=PRIORITY_INTERACTIVE, on_chunk=None, trace_id=None):
+        key = self.cache.key(text, source_language, target_language, dialect)
+        translated = self.cache.get(key)
+        if translated is not None:
+            return translated
+
+        # Failures raise TranslationError, so only real translations are cached
+        translated = self.client.translate(
+            text, target_language, source_language=source_language, dialect=dialect, timeout=timeout,
+            priority=priority, on_chunk=on_chunk, trace_id=trace_id
+        )
+        self.cache.set(key, translated)
+        return translated
+
+    def translate_many(self, texts, target_language, source_language='', dialect='', timeout=None,
+                       priority=PRIORITY_BULK, trace_id=None):
+        keys = [self.cache.key(text, source_language, target_language, dialect) for text in texts]
+        results = [self.cache.get(key) for key in keys]
+
+        # Each distinct missing text is sent once, however often it repeats in the batch
+        missing = {}
+        for index, translated in enumerate(results):
+            if translated is None:
+                missing.setdefault(keys[index], []).append(index)
+        if not missing:
+            return results
+
+        indexes = list(missing.values())
+        translations = self.client.translate_many(
+            [texts[group[0]] for group in indexes], target_language, source_language=source_language,
+            dialect=dialect, timeout=timeout, priority=priority, trace_id=trace_id
+        )
+        for group, translated in zip(indexes, translations):
+            if translated is None:
+                continue
+            self.cache.set(keys[group[0]], translated)
+            for index in group:
+                results[index] = translated
+        return results
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
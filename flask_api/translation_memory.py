@@ -0,0 +1,378 @@
+import logging
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import select, delete, func
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import TranslationMemorySegment
+from translation_cache import LRUCache, cache_key, normalize_text
+from translation_service import PRIORITY_INTERACTIVE, PRIORITY_BULK
+
+# Sentence ends (followed by whitespace) and line breaks separate segments
+SEGMENT_BOUNDARY = re.compile(r'((?<=[.!?…。！？])\s+|\s*\n\s*)')
+
+def split_segments(text):
+    # Returns (segments, separators) with text == ''.join(s + sep for s, sep in zip(...))
+    parts = SEGMENT_BOUNDARY.split(text)
+    return parts[0::2], parts[1::2] + ['']
+
+def join_segments(segments, separators):
+    return ''.join(segment + separator for segment, separator in zip(segments, separators))
+
+def align_segments(source_segments, translation):
+    # A whole-message translation can be stored per sentence when it splits
+    # into as many sentences as the source did
+    segments, _ = split_segments(translation)
+    if len(segments) != len(source_segments):
+        return None
+    return segments
+
+class MinHashIndex:
+    # Locality-sensitive index of character trigram MinHash signatures, used to
+    # find previously translated sentences that are similar but not equal.
+    PRIME = (1 << 61) - 1
+
+    def __init__(self, num_perm=16, bands=8, maxsize=100000):
+        self.rows = num_perm // bands
+        self.bands = bands
+        self.maxsize = maxsize
+        # Fixed coefficients so signatures are comparable across restarts
+        self.perms = [((i * 0x9E3779B1 + 1) % self.PRIME, (i * 0x85EBCA6B + 7) % self.PRIME) for i in range(num_perm)]
+        self.entries = OrderedDict()
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def signature(self, text):
+        shingles = {text[i:i + 3] for i in range(max(1, len(text) - 2))}
+        hashes = [zlib.crc32(shingle.encode()) for shingle in shingles]
+        return tuple(min((a * h + b) % self.PRIME for h in hashes) for a, b in self.perms)
+
+    def _band_keys(self, pair, signature):
+        return [(pair, band, signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+    def add(self, pair, key, source, translation):
+        signature = self.signature(source)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return
+            self.entries[key] = (pair, signature, source, translation)
+            for band_key in self._band_keys(pair, signature):
+                self.buckets.setdefault(band_key, set()).add(key)
+            while len(self.entries) > self.maxsize:
+                self._evict()
+
+    def _evict(self):
+        key, (pair, signature, _, _) = self.entries.popitem(last=False)
+        for band_key in self._band_keys(pair, signature):
+            bucket = self.buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band_key]
+
+    def query(self, pair, source, threshold, limit):
+        # Returns up to limit (similarity, source, translation), most similar first
+        signature = self.signature(source)
+        with self.lock:
+            candidates = set()
+            for band_key in self._band_keys(pair, signature):
+                candidates.update(self.buckets.get(band_key, ()))
+            matches = []
+            for key in candidates:
+                _, other, other_source, translation = self.entries[key]
+                similarity = sum(a == b for a, b in zip(signature, other)) / len(signature)
+                if similarity >= threshold and other_source != source:
+                    matches.append((similarity, other_source, translation))
+        matches.sort(reverse=True)
+        return matches[:limit]
+
+    def __len__(self):
+        return len(self.entries)
+
+class TranslationMemory:
+    # Sentence-level translations keyed like the message cache, kept in SQL
+    # with an in-process LRU in front and a MinHash index for near matches.
+    # Only keys and translations are stored; the MinHash index holds sentences
+    # this process has seen, so near matches are learned again after a restart.
+    PRUNE_EVERY = 1000
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.local = None
+        self.index = None
+        self.model = None
+        self.writes = 0
+        self.segments = 0
+        self.exact_hits = 0
+        self.fuzzy_matches = 0
+        self.model_segments = 0
+        self.saved_chars = 0
+        self.model_chars = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config['TRANSLATION_MEMORY']
+        self.persist = app.config['TRANSLATION_MEMORY_PERSIST']
+        self.model = app.config['TRANSLATION_MODEL']
+        self.maxsize = app.config['TRANSLATION_MEMORY_SIZE']
+        self.fuzzy_threshold = app.config['TRANSLATION_MEMORY_FUZZY_THRESHOLD']
+        self.references = app.config['TRANSLATION_MEMORY_REFERENCES']
+        self.local = LRUCache(app.config['TRANSLATION_MEMORY_LOCAL_SIZE'], app.config['TRANSLATION_CACHE_TTL'])
+        self.index = MinHashIndex(maxsize=app.config['TRANSLATION_MEMORY_INDEX_SIZE'])
+
+    def key(self, segment, source_language, target_language, dialect):
+        return cache_key(segment, source_language, target_language, dialect, self.model)
+
+    def get_many(self, keys):
+        # {key: translation} for the keys that are known, with one SQL query for local misses
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is not None:
+                found[key] = value
+            else:
+                missing.append(key)
+        if missing and self.persist:
+            try:
+                with self.app.app_context(), db.engine.connect() as conn:
+                    rows = conn.execute(
+                        select(TranslationMemorySegment.key, TranslationMemorySegment.translation)
+                        .where(TranslationMemorySegment.key.in_(set(missing)))
+                    ).all()
+            except Exception as error:
+                logging.warning(f"Translation memory lookup failed: {error}")
+                rows = []
+            for key, translation in rows:
+                self.local.set(key, translation)
+                found[key] = translation
+        return found
+
+    def add_many(self, entries, source_language, target_language, dialect):
+        # entries are (key, normalized source, translation)
+        # The same sentence can be learned twice from one batch
+        entries = list({key: (key, source, translation) for key, source, translation in entries}.values())
+        if not entries:
+            return
+        pair = (source_language, target_language, dialect)
+        for key, source, translation in entries:
+            self.local.set(key, translation)
+            self.index.add(pair, key, source, translation)
+        if not self.persist:
+            return
+
+        table = TranslationMemorySegment.__table__
+        now = datetime.utcnow()
+        rows = [
+            {'key': key, 'source_language': source_language, 'target_language': target_language,
+             'translation': translation, 'created_at': now}
+            for key, _, translation in entries
+        ]
+        with self.app.app_context():
+            try:
+                try:
+                    with db.engine.begin() as conn:
+                        conn.execute(table.insert(), rows)
+                except IntegrityError:
+                    # Another worker stored some of these sentences first
+                    for row in rows:
+                        try:
+                            with db.engine.begin() as conn:
+                                conn.execute(table.insert(), row)
+                        except IntegrityError:
+                            pass
+            except Exception as error:
+                logging.warning(f"Translation memory write failed: {error}")
+                return
+
+            self.writes += len(rows)
+            if self.writes >= self.PRUNE_EVERY:
+                self.writes = 0
+                self.prune()
+
+    def prune(self):
+        table = TranslationMemorySegment.__table__
+        with db.engine.begin() as conn:
+            excess = conn.execute(select(func.count()).select_from(table)).scalar() - self.maxsize
+            if excess > 0:
+                oldest = select(table.c.key).order_by(table.c.created_at).limit(excess)
+                conn.execute(delete(table).where(table.c.key.in_(oldest)))
+
+    def similar(self, segment, source_language, target_language, dialect):
+        if not self.references:
+            return []
+        matches = self.index.query(
+            (source_language, target_language, dialect), normalize_text(segment), self.fuzzy_threshold, self.references
+        )
+        self.fuzzy_matches += len(matches)
+        return [[source, translation] for _, source, translation in matches]
+
+    def stats(self):
+        return {
+            'segments': self.segments,
+            'exact_hits': self.exact_hits,
+            'fuzzy_matches': self.fuzzy_matches,
+            'model_segments': self.model_segments,
+            'hit_rate': self.exact_hits / self.segments if self.segments else 0.0,
+            'saved_chars': self.saved_chars,
+            'model_chars': self.model_chars,
+            'indexed': len(self.index) if self.index is not None else 0
+        }
+
+class MessagePlan:
+    # One text split into segments, with the ones already in memory filled in
+    def __init__(self, memory, text, source_language, target_language, dialect):
+        self.segments, self.separators = split_segments(text)
+        self.keys = [
+            memory.key(segment, source_language, target_language, dialect) if segment.strip() else None
+            for segment in self.segments
+        ]
+        self.translations = [segment if key is None else None for segment, key in zip(self.segments, self.keys)]
+        # Set when the message went to the model whole
+        self.whole = None
+        self.failed = False
+
+    def fill(self, known):
+        for index, key in enumerate(self.keys):
+            if key is not None and key in known:
+                self.translations[index] = known[key]
+
+    @property
+    def missing(self):
+        return [index for index, translation in enumerate(self.translations) if translation is None]
+
+    @property
+    def untouched(self):
+        # Nothing came from memory, so the model sees the message as a whole
+        return len(self.missing) == sum(key is not None for key in self.keys)
+
+    def result(self):
+        return join_segments([translation.strip() for translation in self.translations], self.separators)
+
+class MemoryTranslationClient:
+    # Sits between the message cache and the RPC client. Sentences found in
+    # memory are not sent to the model: a message with no hits is translated
+    # whole (keeping context and streaming), otherwise only the missing
+    # sentences go out, in one translate_many call, and are stitched back.
+    def __init__(self, client, memory):
+        self.client = client
+        self.memory = memory
+
+    def translate(self, text, target_language, source_language='', dialect='', timeout=None,
+                  priority=PRIORITY_INTERACTIVE, on_chunk=None, trace_id=None):
+        if not self.memory.enabled:
+            return self.client.translate(
+                text, target_language, source_language=source_language, dialect=dialect, timeout=timeout,
+                priority=priority, on_chunk=on_chunk, trace_id=trace_id
+            )
+        return self._translate([text], target_language, source_language, dialect, timeout, priority,
+                               on_chunk, trace_id)[0]
+
+    def translate_many(self, texts, target_language, source_language='', dialect='', timeout=None,
+                       priority=PRIORITY_BULK, trace_id=None):
+        if not self.memory.enabled:
+            return self.client.translate_many(
+                texts, target_language, source_language=source_language, dialect=dialect, timeout=timeout,
+                priority=priority, trace_id=trace_id
+            )
+        return self._translate(texts, target_language, source_language, dialect, timeout, priority,
+                               None, trace_id, many=True)
+
+    def _translate(self, texts, target_language, source_language, dialect, timeout, priority, on_chunk,
+                   trace_id, many=False):
+        memory = self.memory
+        plans = [MessagePlan(memory, text, source_language, target_language, dialect) for text in texts]
+        known = memory.get_many({key for plan in plans for key in plan.keys if key is not None})
+
+        # Requests to the model: whole messages without hits, then each distinct missing sentence
+        requests = []
+        seen = {}
+        for plan_index, plan in enumerate(plans):
+            plan.fill(known)
+            total = sum(key is not None for key in plan.keys)
+            missing = plan.missing
+            memory.segments += total
+            memory.exact_hits += total - len(missing)
+            memory.saved_chars += sum(len(plan.segments[i]) for i in range(len(plan.segments))
+                                      if plan.keys[i] is not None and i not in missing)
+            if not missing:
+                continue
+            if plan.untouched:
+                requests.append((plan_index, None, texts[plan_index]))
+                continue
+            for index in missing:
+                key = plan.keys[index]
+                if key not in seen:
+                    seen[key] = len(requests)
+                    requests.append((plan_index, index, plan.segments[index]))
+
+        if requests:
+            for _, _, text in requests:
+                memory.model_chars += len(text)
+            memory.model_segments += len(requests)
+            translations = self._send(requests, target_language, source_language, dialect, timeout, priority,
+                                      on_chunk, trace_id, many)
+        else:
+            translations = []
+
+        learned = []
+        by_key = {}
+        for (plan_index, segment_index, text), translated in zip(requests, translations):
+            plan = plans[plan_index]
+            if translated is None:
+                plan.failed = True
+                continue
+            if segment_index is None:
+                # Whole message: keep its sentences when they line up with the source's
+                aligned = align_segments(plan.segments, translated)
+                if aligned is not None:
+                    for key, source, target in zip(plan.keys, plan.segments, aligned):
+                        if key is not None:
+                            learned.append((key, normalize_text(source), target.strip()))
+                plan.whole = translated
+                continue
+            key = plan.keys[segment_index]
+            by_key[key] = translated
+            learned.append((key, normalize_text(text), translated.strip()))
+
+        results = []
+        for plan in plans:
+            if plan.whole is not None:
+                results.append(plan.whole)
+                continue
+            plan.fill(by_key)
+            results.append(None if plan.failed or plan.missing else plan.result())
+
+        memory.add_many(learned, source_language, target_language, dialect)
+        return results
+
+    def _send(self, requests, target_language, source_language, dialect, timeout, priority, on_chunk,
+              trace_id, many):
+        if not many and len(requests) == 1:
+            # A single message or sentence keeps streaming; a single sentence
+            # also gets similar ones from memory as references for consistent wording
+            _, segment_index, text = requests[0]
+            references = []
+            if len(split_segments(text)[0]) == 1:
+                references = self.memory.similar(text, source_language, target_language, dialect)
+            if segment_index is not None:
+                # Partial output of one sentence is not the message, so it is not relayed
+                on_chunk = None
+            return [self.client.translate(
+                text, target_language, source_language=source_language, dialect=dialect, timeout=timeout,
+                priority=priority, on_chunk=on_chunk, trace_id=trace_id, references=references
+            )]
+        return self.client.translate_many(
+            [text for _, _, text in requests], target_language, source_language=source_language,
+            dialect=dialect, timeout=timeout, priority=priority, trace_id=trace_id
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
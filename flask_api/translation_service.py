@@ -1,76 +1,345 @@
 import pika
-import json
 import uuid
 from config import Config
 import logging
 import time
+import threading
+import queue
+from contextlib import contextmanager
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from timing import span
+import wire
+
+# Keep in sync with llm_service/llm_service.py
+REQUEST_QUEUE = 'llm_requests'
+REQUEST_QUEUE_ARGUMENTS = {'x-max-priority': 10}
+PRIORITY_INTERACTIVE = 9
+PRIORITY_BULK = 1
+
+def request_queue(target_language):
+    if target_language in Config.TRANSLATION_PINNED_LANGUAGES:
+        return f'{REQUEST_QUEUE}.{target_language}'
+    return REQUEST_QUEUE
+
+def language_payload(target_language, source_language, dialect):
+    # Empty source_language and dialect are left out, the worker treats them as unknown/none
+    payload = {'target_language': target_language}
+    if source_language:
+        payload['source_language'] = source_language
+    if dialect:
+        payload['dialect'] = dialect
+    return payload
+
+def create_codec():
+    content_type = wire.MSGPACK if Config.TRANSLATION_WIRE_FORMAT == 'msgpack' else wire.JSON
+    return wire.Codec(content_type, Config.TRANSLATION_WIRE_COMPRESSION, Config.TRANSLATION_WIRE_COMPRESS_MIN)
+
+class TranslationError(Exception):
+    pass
+
+class TranslationTimeout(TranslationError):
+    pass
+
+def open_connection():
+    return pika.BlockingConnection(
+        pika.ConnectionParameters(
+            host=Config.RABBITMQ_HOST,
+            connection_attempts=5,
+            retry_delay=5
+        )
+    )
+
+class ChannelPool:
+    # pika connections are not safe to share, so every pooled channel gets its
+    # own connection and is checked out by exactly one greenlet at a time.
+    def __init__(self, size):
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.in_use = 0
+
+    @contextmanager
+    def channel(self, timeout=None):
+        if not self.slots.acquire(timeout=timeout):
+            raise TranslationTimeout("Timed out waiting for a RabbitMQ channel")
+
+        self.in_use += 1
+        connection = channel = None
+        try:
+            connection, channel = self._checkout()
+            yield channel
+        except pika.exceptions.AMQPError:
+            self._discard(connection)
+            connection = None
+            raise
+        finally:
+            if connection is not None:
+                self.idle.put((connection, channel))
+            self.in_use -= 1
+            self.slots.release()
+
+    def _checkout(self):
+        while True:
+            try:
+                connection, channel = self.idle.get_nowait()
+            except queue.Empty:
+                connection = open_connection()
+                channel = connection.channel()
+                if Config.RABBITMQ_PUBLISHER_CONFIRMS:
+                    # basic_publish now raises NackError/UnroutableError instead of losing the request
+                    channel.confirm_delivery()
+                return connection, channel
+
+            try:
+                # Services heartbeats that were missed while the channel sat idle
+                connection.process_data_events(time_limit=0)
+                if channel.is_open:
+                    return connection, channel
+            except pika.exceptions.AMQPError:
+                pass
+            self._discard(connection)
+
+    def _discard(self, connection):
+        if connection is None:
+            return
+        try:
+            if connection.is_open:
+                connection.close()
+        except pika.exceptions.AMQPError:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                connection, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(connection)
 
 class TranslationServiceClient:
-    def __init__(self):
-        self.connection = None
-        self.channel = None
+    def __init__(self, pool_size=None, timeout=None):
+        self.pool = ChannelPool(pool_size or Config.RABBITMQ_CHANNEL_POOL_SIZE)
+        self.timeout = timeout or Config.TRANSLATION_TIMEOUT
         self.callback_queue = None
-        self.response = None
-        self.corr_id = None
+        self.pending = {}
+        # corr_id -> [on_chunk callback, next expected seq] for streaming requests
+        self.chunk_handlers = {}
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+        self.consumer = None
+        self.stopping = False
+        self.declared = set()
+        self.codec = create_codec()
+
+    def start(self):
+        with self.lock:
+            if self.consumer is None or not self.consumer.is_alive():
+                self.stopping = False
+                self.consumer = threading.Thread(target=self._consume, daemon=True)
+                self.consumer.start()
+
+    def stop(self):
+        self.stopping = True
+        self.pool.close()
 
-    def connect(self):
-        retries = 5
-        while retries > 0:
+    def _consume(self):
+        # One consumer on one exclusive callback queue serves every in-flight request
+        while not self.stopping:
+            connection = None
             try:
-                self.connection = pika.BlockingConnection(
-                    pika.ConnectionParameters(
-                        host=Config.RABBITMQ_HOST,
-                        connection_attempts=5,
-                        retry_delay=5
-                    )
-                )
-                self.channel = self.connection.channel()
+                connection = open_connection()
+                channel = connection.channel()
 
-                result = self.channel.queue_declare(queue='', exclusive=True)
+                result = channel.queue_declare(queue='', exclusive=True)
                 self.callback_queue = result.method.queue
 
-                self.channel.basic_consume(
+                channel.basic_consume(
                     queue=self.callback_queue,
                     on_message_callback=self.on_response,
                     auto_ack=True
                 )
+                self.ready.set()
                 logging.info("Successfully connected to RabbitMQ")
-                return True
-            except pika.exceptions.AMQPConnectionError as error:
-                logging.warning(f"Failed to connect to RabbitMQ: {error}. Retrying...")
-                retries -= 1
+
+                while not self.stopping:
+                    connection.process_data_events(time_limit=1)
+            except pika.exceptions.AMQPError as error:
+                logging.warning(f"Lost RabbitMQ reply consumer: {error}. Retrying...")
+            finally:
+                self.ready.clear()
+                self.callback_queue = None
+                # Replies for the old callback queue can never arrive
+                self._fail_pending(TranslationError("Lost connection to RabbitMQ"))
+                if connection is not None and connection.is_open:
+                    try:
+                        connection.close()
+                    except pika.exceptions.AMQPError:
+                        pass
+
+            if not self.stopping:
                 time.sleep(5)
-        
-        logging.error("Failed to connect to RabbitMQ after multiple attempts")
-        return False
+
+    def _fail_pending(self, error):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
 
     def on_response(self, ch, method, props, body):
-        if self.corr_id == props.correlation_id:
-            self.response = json.loads(body)
+        try:
+            response = self.codec.decode(
+                body, props.content_type, props.content_encoding, (props.headers or {}).get('wire')
+            )
+        except Exception:
+            logging.exception(f"Undecodable translation reply {props.correlation_id}")
+            return
+        if 'chunk' in response:
+            self._on_chunk(props.correlation_id, response)
+            return
+
+        with self.lock:
+            future = self.pending.pop(props.correlation_id, None)
+        if future is None or future.done():
+            # Late reply for a request that timed out or was cancelled
+            return
+        future.set_result(response)
+
+    def _on_chunk(self, corr_id, response):
+        handler = self.chunk_handlers.get(corr_id)
+        if handler is None:
+            return
+        on_chunk, next_seq = handler
+        if response['seq'] < next_seq:
+            # Duplicate or out of order partial output
+            return
+        handler[1] = response['seq'] + 1
+        try:
+            on_chunk(response['seq'], response['chunk'])
+        except Exception:
+            logging.exception("Translation chunk handler failed")
+
+    def _declare(self, channel, queue_name):
+        # Publishing to a queue that does not exist yet silently drops the request
+        if queue_name not in self.declared:
+            channel.queue_declare(queue=queue_name, arguments=REQUEST_QUEUE_ARGUMENTS)
+            self.declared.add(queue_name)
+
+    def queue_depths(self, timeout=None):
+        # (queue, waiting messages, consumers) for every request queue this client publishes to
+        depths = []
+        with self.pool.channel(timeout) as channel:
+            pinned = {request_queue(language) for language in Config.TRANSLATION_PINNED_LANGUAGES}
+            for queue_name in sorted(self.declared | pinned | {REQUEST_QUEUE}):
+                result = channel.queue_declare(queue=queue_name, arguments=REQUEST_QUEUE_ARGUMENTS)
+                self.declared.add(queue_name)
+                depths.append((queue_name, result.method.message_count, result.method.consumer_count))
+        return depths
 
-    def translate(self, text, target_language):
-        if not self.connection or self.connection.is_closed:
-            if not self.connect():
-                return "Translation service is currently unavailable."
+    def submit(self, text, target_language, source_language='', dialect='', timeout=None,
+               priority=PRIORITY_INTERACTIVE, on_chunk=None, trace_id=None, references=None):
+        # With on_chunk, the worker streams partial output which is passed to
+        # on_chunk(seq, text) as it arrives; the future still resolves with the full text.
+        # references are [source, translation] pairs of similar sentences for the prompt.
+        payload = language_payload(target_language, source_language, dialect)
+        payload.update({'text': text, 'stream': on_chunk is not None})
+        if references:
+            payload['references'] = references
+        return self._submit(payload, target_language, timeout, priority, on_chunk, trace_id)
 
-        self.response = None
-        self.corr_id = str(uuid.uuid4())
+    def submit_many(self, texts, target_language, source_language='', dialect='', timeout=None,
+                    priority=PRIORITY_BULK, trace_id=None):
+        # One request for many texts; the worker feeds them through its batcher
+        payload = language_payload(target_language, source_language, dialect)
+        payload['texts'] = list(texts)
+        return self._submit(payload, target_language, timeout, priority, trace_id=trace_id)
+
+    def _submit(self, payload, target_language, timeout, priority, on_chunk=None, trace_id=None):
+        timeout = timeout or self.timeout
+        self.start()
+        if not self.ready.wait(timeout):
+            raise TranslationError("Translation service is currently unavailable.")
+
+        corr_id = str(uuid.uuid4())
+        future = Future()
+        with self.lock:
+            self.pending[corr_id] = future
+            if on_chunk is not None:
+                self.chunk_handlers[corr_id] = [on_chunk, 0]
+        future.add_done_callback(lambda _: self._forget(corr_id))
 
         try:
-            self.channel.basic_publish(
-                exchange='',
-                routing_key='llm_queue',
-                properties=pika.BasicProperties(
-                    reply_to=self.callback_queue,
-                    correlation_id=self.corr_id
-                ),
-                body=json.dumps({'text': text, 'target_language': target_language})
-            )
+            queue_name = request_queue(target_language)
+            with span('rpc.encode'):
+                body, content_type, content_encoding = self.codec.encode(payload)
+            headers = {'trace_id': trace_id or corr_id, 'sent_at': time.time()}
+            headers.update(self.codec.headers())
+            with span('rpc.publish'), self.pool.channel(timeout) as channel:
+                self._declare(channel, queue_name)
+                channel.basic_publish(
+                    exchange='',
+                    routing_key=queue_name,
+                    mandatory=True,
+                    properties=pika.BasicProperties(
+                        reply_to=self.callback_queue,
+                        correlation_id=corr_id,
+                        priority=priority,
+                        content_type=content_type,
+                        content_encoding=content_encoding,
+                        # Let the broker drop requests nobody is waiting for anymore
+                        expiration=str(int(timeout * 1000)),
+                        # trace_id ties the worker's logs and timings to this request,
+                        # sent_at lets it measure time spent queued in the broker
+                        headers=headers
+                    ),
+                    body=body
+                )
+        except pika.exceptions.AMQPError as error:
+            logging.error(f"Failed to publish translation request: {error}")
+            future.cancel()
+            raise TranslationError("Translation service is currently unavailable.")
+        except TranslationTimeout:
+            future.cancel()
+            raise
+
+        return future
+
+    def _forget(self, corr_id):
+        with self.lock:
+            self.pending.pop(corr_id, None)
+            self.chunk_handlers.pop(corr_id, None)
+
+    def _wait(self, future, timeout):
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TranslationTimeout(f"Translation timed out after {timeout}s")
+
+    def translate(self, text, target_language, source_language='', dialect='', timeout=None,
+                  priority=PRIORITY_INTERACTIVE, on_chunk=None, trace_id=None, references=None):
+        timeout = timeout or self.timeout
+        response = self._wait(self.submit(
+            text, target_language, source_language, dialect, timeout, priority, on_chunk, trace_id, references
+        ), timeout)
+        if 'error' in response:
+            raise TranslationError(response['error'])
+        return response.get('response', '')
+
+    def translate_many(self, texts, target_language, source_language='', dialect='', timeout=None,
+                       priority=PRIORITY_BULK, trace_id=None):
+        # Returns one translation per text, None where that item failed
+        timeout = timeout or self.timeout
+        response = self._wait(self.submit_many(
+            texts, target_language, source_language, dialect, timeout, priority, trace_id
+        ), timeout)
+        if 'error' in response:
+            raise TranslationError(response['error'])
+        return [
+            translated if error is None else None
+            for translated, error in zip(response['responses'], response['errors'])
+        ]
 
-            while self.response is None:
-                self.connection.process_data_events()
-            return self.response.get('response', '')
-        except pika.exceptions.AMQPConnectionError:
-            logging.error("Lost connection to RabbitMQ during translation")
-            self.connection = None
-            return "Translation service is currently unavailable."
\ No newline at end of file
+    @property
+    def in_flight(self):
+        return len(self.pending)
@@ -0,0 +1,109 @@
+import json
+import logging
+import threading
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Envelope for translation requests and replies. Keep in sync with
+# llm_service/wire.py. The body format travels in the AMQP content_type and
+# content_encoding properties, so a peer that sends neither is read as plain
+# JSON, and replies use the requester's format: old JSON peers keep working.
+# Requests list the compressions their sender can read in the
+# 'accept_encoding' header; replies only use one from that list.
+
+VERSION = 1
+JSON = 'application/json'
+MSGPACK = 'application/x-msgpack'
+CONTENT_TYPES = (JSON, MSGPACK)
+COMPRESSIONS = ('zstd', 'zlib')
+
+def readable_encodings():
+    return [name for name in COMPRESSIONS if name != 'zstd' or zstandard is not None]
+
+class Codec:
+    def __init__(self, content_type=MSGPACK, compression='zstd', compress_min=1024, level=3):
+        if content_type not in CONTENT_TYPES:
+            raise ValueError(f"Unknown wire content type: {content_type}")
+        if content_type == MSGPACK and msgpack is None:
+            logging.warning("msgpack is not installed, sending JSON")
+            content_type = JSON
+        if compression not in COMPRESSIONS + ('', 'none'):
+            raise ValueError(f"Unknown wire compression: {compression}")
+        if compression == 'zstd' and zstandard is None:
+            logging.warning("zstandard is not installed, compressing with zlib")
+            compression = 'zlib'
+        self.content_type = content_type
+        self.compression = compression if compression in COMPRESSIONS else None
+        # Below this many bytes compression costs more time than it saves on the wire
+        self.compress_min = compress_min
+        self.level = level
+        # zstd (de)compressor objects must not be shared between threads
+        self.local = threading.local()
+
+    def headers(self):
+        # Added to every request so the other side knows what it may reply with
+        return {'wire': VERSION, 'accept_encoding': ','.join(readable_encodings())}
+
+    def encode(self, payload, content_type=None, accept_encoding=None):
+        # Returns (body, content_type, content_encoding). For a reply, pass the
+        # request's content_type and accept_encoding header.
+        content_type = content_type if content_type in CONTENT_TYPES else self.content_type
+        if content_type == MSGPACK and msgpack is None:
+            content_type = JSON
+        if content_type == MSGPACK:
+            body = msgpack.packb(payload, use_bin_type=True)
+        else:
+            body = json.dumps(payload, separators=(',', ':')).encode()
+
+        compression = self.compression
+        if accept_encoding is not None:
+            # A reply: '' (a peer that sent no header) means uncompressed
+            accepted = accept_encoding.split(',')
+            if compression not in accepted:
+                compression = next((name for name in readable_encodings() if name in accepted), None)
+        if compression is None or len(body) < self.compress_min:
+            return body, content_type, None
+        if compression == 'zstd':
+            return self._zstd_compressor().compress(body), content_type, 'zstd'
+        return zlib.compress(body, self.level), content_type, 'zlib'
+
+    def decode(self, body, content_type=None, content_encoding=None, version=None):
+        # Pass the 'wire' header; None is a peer from before the envelope (plain JSON)
+        if version is not None and version != VERSION:
+            raise ValueError(f"Unsupported wire version {version!r}, expected {VERSION}")
+        if content_type not in (None, '') + CONTENT_TYPES:
+            raise ValueError(f"Unknown wire content type: {content_type}")
+        if content_encoding not in (None, '') + COMPRESSIONS:
+            raise ValueError(f"Unknown wire compression: {content_encoding}")
+        if content_encoding == 'zstd':
+            if zstandard is None:
+                raise ValueError("Received a zstd body but zstandard is not installed")
+            body = self._zstd_decompressor().decompress(body)
+        elif content_encoding == 'zlib':
+            body = zlib.decompress(body)
+        if content_type == MSGPACK:
+            if msgpack is None:
+                raise ValueError("Received a msgpack body but msgpack is not installed")
+            return msgpack.unpackb(body, raw=False)
+        return json.loads(body)
+
+    def _zstd_compressor(self):
+        compressor = getattr(self.local, 'compressor', None)
+        if compressor is None:
+            compressor = self.local.compressor = zstandard.ZstdCompressor(level=self.level)
+        return compressor
+
+    def _zstd_decompressor(self):
+        decompressor = getattr(self.local, 'decompressor', None)
+        if decompressor is None:
+            decompressor = self.local.decompressor = zstandard.ZstdDecompressor()
+        return decompressor
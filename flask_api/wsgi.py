@@ -0,0 +1,10 @@
+import eventlet
+
+# Must run before anything imports socket, ssl or threading
+eventlet.monkey_patch()
+
+from app import app
+from routes import translation_jobs
+
+# Only serving processes sweep; CLI commands that import app do not
+translation_jobs.start_sweeper(app)
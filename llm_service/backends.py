@@ -0,0 +1,169 @@
+import logging
+import re
+import threading
+import time
+import metrics
+
+SEGMENT_PATTERN = re.compile(r'^\s*\[(\d+)\]\s?(.*)$')
+
+# Keep to the codes users can pick in flask_api; anything else is passed to the model as is
+LANGUAGE_NAMES = {
+    'ar': 'Arabic', 'de': 'German', 'el': 'Greek', 'en': 'English', 'es': 'Spanish', 'fr': 'French',
+    'he': 'Hebrew', 'hi': 'Hindi', 'it': 'Italian', 'ja': 'Japanese', 'ko': 'Korean', 'nl': 'Dutch',
+    'pt': 'Portuguese', 'ru': 'Russian', 'th': 'Thai', 'zh': 'Chinese'
+}
+
+def language_name(language, dialect=''):
+    # ('es', 'Mexican') -> 'Mexican Spanish'
+    code = (language or '').replace('_', '-').split('-')[0].lower()
+    name = LANGUAGE_NAMES.get(code, language)
+    return f'{dialect} {name}' if dialect else name
+
+def describe_languages(target_language, source_language='', dialect=''):
+    target = language_name(target_language, dialect)
+    if source_language:
+        return f'from {language_name(source_language)} to {target}'
+    return f'to {target}'
+
+def build_prompt(text, target_language, references=(), source_language='', dialect=''):
+    prompt = 'translate this ' + describe_languages(target_language, source_language, dialect) + ': ' + text
+    if references:
+        # Earlier translations of similar sentences, from flask_api's translation memory
+        prompt += '\nFor consistency, similar sentences were translated like this:\n' + '\n'.join(
+            f'{source} => {translation}' for source, translation in references
+        )
+    return prompt
+
+def build_batch_prompt(texts, target_language, source_language='', dialect=''):
+    segments = '\n'.join(f'[{i}] {text}' for i, text in enumerate(texts, 1))
+    return (
+        'translate each numbered line ' + describe_languages(target_language, source_language, dialect) + '. '
+        'Reply with exactly one line per input, keeping the [n] numbers and nothing else.\n'
+        + segments
+    )
+
+def split_batch_response(content, count):
+    # Returns None when the model did not keep one numbered line per segment
+    results = {}
+    for line in content.splitlines():
+        match = SEGMENT_PATTERN.match(line)
+        if match:
+            results[int(match.group(1))] = match.group(2).strip()
+    if sorted(results) != list(range(1, count + 1)):
+        return None
+    return [results[i] for i in range(1, count + 1)]
+
+class OllamaBackend:
+    def __init__(self, host, model):
+        from ollama import Client
+
+        self.host = host
+        self.model = model
+        self.client = Client(host=host)
+
+    def chat(self, prompt):
+        response = self.client.chat(model=self.model, messages=[
+            {
+                'role': 'user',
+                'content': prompt,
+            },
+        ])
+        return response['message']['content']
+
+    def translate(self, text, target_language, references=(), source_language='', dialect=''):
+        return self.chat(build_prompt(text, target_language, references, source_language, dialect))
+
+    def stream(self, text, target_language, references=(), source_language='', dialect=''):
+        for part in self.client.chat(model=self.model, stream=True, messages=[
+            {
+                'role': 'user',
+                'content': build_prompt(text, target_language, references, source_language, dialect),
+            },
+        ]):
+            yield part['message']['content']
+
+    def translate_batch(self, texts, target_language, source_language='', dialect=''):
+        if len(texts) == 1:
+            return [self.translate(texts[0], target_language, (), source_language, dialect)]
+        return split_batch_response(
+            self.chat(build_batch_prompt(texts, target_language, source_language, dialect)), len(texts)
+        )
+
+def backend_name(backend):
+    return str(getattr(backend, 'host', backend))
+
+class BackendPool:
+    # Routes each call to the healthy endpoint with the fewest outstanding
+    # requests. An endpoint that fails max_failures times in a row is ejected
+    # for eject_seconds, after which it gets traffic again.
+    def __init__(self, backends, max_failures=3, eject_seconds=30):
+        if not backends:
+            raise ValueError("BackendPool needs at least one backend")
+        self.backends = backends
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.outstanding = {id(backend): 0 for backend in backends}
+        self.failures = {id(backend): 0 for backend in backends}
+        self.ejected_until = {id(backend): 0.0 for backend in backends}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_hosts(cls, hosts, model, **kwargs):
+        return cls([OllamaBackend(host, model) for host in hosts], **kwargs)
+
+    def healthy(self):
+        now = time.monotonic()
+        return [b for b in self.backends if self.ejected_until[id(b)] <= now]
+
+    def _acquire(self):
+        with self.lock:
+            candidates = self.healthy()
+            if not candidates:
+                # Everything is ejected: try whichever comes back first
+                candidates = [min(self.backends, key=lambda b: self.ejected_until[id(b)])]
+            backend = min(candidates, key=lambda b: self.outstanding[id(b)])
+            self.outstanding[id(backend)] += 1
+        metrics.BACKEND_OUTSTANDING.labels(backend_name(backend)).inc()
+        return backend
+
+    def _release(self, backend, ok):
+        metrics.BACKEND_OUTSTANDING.labels(backend_name(backend)).dec()
+        with self.lock:
+            key = id(backend)
+            self.outstanding[key] -= 1
+            if ok:
+                self.failures[key] = 0
+                return
+            self.failures[key] += 1
+            if self.failures[key] >= self.max_failures:
+                self.ejected_until[key] = time.monotonic() + self.eject_seconds
+                self.failures[key] = 0
+                metrics.BACKEND_EJECTIONS.labels(backend_name(backend)).inc()
+                logging.warning(f"Ejecting model backend {backend_name(backend)} for {self.eject_seconds}s")
+
+    def _call(self, method, *args):
+        backend = self._acquire()
+        started = time.monotonic()
+        try:
+            result = getattr(backend, method)(*args)
+        except Exception:
+            self._release(backend, ok=False)
+            raise
+        metrics.BACKEND_SECONDS.labels(backend_name(backend), method).observe(time.monotonic() - started)
+        self._release(backend, ok=True)
+        return result
+
+    def translate(self, text, target_language, references=(), source_language='', dialect=''):
+        return self._call('translate', text, target_language, references, source_language, dialect)
+
+    def translate_batch(self, texts, target_language, source_language='', dialect=''):
+        return self._call('translate_batch', texts, target_language, source_language, dialect)
+
+    def stream(self, text, target_language, references=(), source_language='', dialect=''):
+        backend = self._acquire()
+        ok = False
+        try:
+            yield from backend.stream(text, target_language, references, source_language, dialect)
+            ok = True
+        finally:
+            self._release(backend, ok)
@@ -0,0 +1,139 @@
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+class Request:
+    def __init__(self, text, target_language, reply_to, correlation_id, delivery_tag, priority=0, group=None,
+                 trace_id=None, references=(), source_language='', dialect=''):
+        self.text = text
+        self.target_language = target_language
+        # source_language is '' when the sender did not detect it
+        self.source_language = source_language
+        self.dialect = dialect
+        self.reply_to = reply_to
+        self.correlation_id = correlation_id
+        self.delivery_tag = delivery_tag
+        self.priority = priority
+        # Set when this text is one item of a multi-text request
+        self.group = group
+        self.trace_id = trace_id or correlation_id
+        # [source, translation] pairs of similar sentences to show the model
+        self.references = references
+        # Idempotency key of the AMQP message, set by the consumer
+        self.key = None
+        # (content_type, accept_encoding) of the AMQP message, replies are encoded to match
+        self.reply_format = None
+        self.received = time.monotonic()
+        self.response = None
+        self.error = None
+
+    @property
+    def languages(self):
+        # Requests can only share a batched prompt when all of these match
+        return self.target_language, self.source_language, self.dialect
+
+    @property
+    def done(self):
+        return self.response is not None or self.error is not None
+
+class RequestGroup:
+    # One AMQP message carrying many texts; replied to once every item is done
+    def __init__(self, texts, target_language, reply_to, correlation_id, delivery_tag, priority=0, trace_id=None,
+                 source_language='', dialect=''):
+        self.reply_to = reply_to
+        self.correlation_id = correlation_id
+        self.delivery_tag = delivery_tag
+        self.trace_id = trace_id or correlation_id
+        self.key = None
+        self.reply_format = None
+        self.received = time.monotonic()
+        self.replied = False
+        self.requests = [
+            Request(text, target_language, reply_to, correlation_id, None, priority, group=self, trace_id=trace_id,
+                    source_language=source_language, dialect=dialect)
+            for text in texts
+        ]
+
+    @property
+    def done(self):
+        return all(request.done for request in self.requests)
+
+class MicroBatcher:
+    # Collects requests until max_batch_size is reached or the oldest request
+    # has waited max_wait_ms, then translates them grouped by language pair and dialect.
+    # mode='concurrent' sends one request per message in parallel so the model
+    # server can batch them itself; mode='prompt' packs each language group
+    # into a single numbered multi-segment prompt.
+    def __init__(self, backend, max_batch_size=8, max_wait_ms=20, mode='concurrent'):
+        if mode not in ('concurrent', 'prompt'):
+            raise ValueError(f"Unknown batch mode: {mode}")
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.mode = mode
+        self.pending = []
+        self.oldest = None
+        self.executor = ThreadPoolExecutor(max_workers=max_batch_size)
+
+    def add(self, request):
+        if not self.pending:
+            self.oldest = time.monotonic()
+        self.pending.append(request)
+
+    def ready(self):
+        if not self.pending:
+            return False
+        return len(self.pending) >= self.max_batch_size or self.time_until_due() == 0
+
+    def time_until_due(self):
+        if not self.pending:
+            return None
+        return max(0.0, self.oldest + self.max_wait - time.monotonic())
+
+    def take(self):
+        # Interactive requests go first, so a large bulk group cannot starve them
+        self.pending.sort(key=lambda request: -request.priority)
+        batch, self.pending = self.pending[:self.max_batch_size], self.pending[self.max_batch_size:]
+        self.oldest = time.monotonic() if self.pending else None
+        return batch
+
+    def process(self, batch):
+        groups = defaultdict(list)
+        for request in batch:
+            groups[request.languages].append(request)
+
+        if self.mode == 'prompt':
+            futures = [self.executor.submit(self._translate_group, group) for group in groups.values()]
+            for future in futures:
+                future.result()
+        else:
+            list(self.executor.map(self._translate_one, batch))
+        return batch
+
+    def _translate_one(self, request):
+        try:
+            request.response = self.backend.translate(
+                request.text, request.target_language, request.references, request.source_language, request.dialect
+            )
+        except Exception as error:
+            logging.exception("Translation failed")
+            request.error = str(error)
+
+    def _translate_group(self, group):
+        try:
+            responses = self.backend.translate_batch([r.text for r in group], *group[0].languages)
+        except Exception:
+            logging.exception("Batched translation failed, retrying one at a time")
+            responses = None
+
+        if responses is None:
+            for request in group:
+                self._translate_one(request)
+            return
+
+        for request, response in zip(group, responses):
+            request.response = response
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,82 @@
+"""Throughput of MicroBatcher against batch size, using a stub model backend.
+
+    python bench_batching.py --requests 256 --call-ms 40 --segment-ms 10 --parallel 4
+
+The stub charges a fixed per-call cost (prompt processing, scheduling) plus a
+per-segment decode cost, and only serves --parallel calls at once, which is
+roughly how a single Ollama/GPU server behaves.
+"""
+import argparse
+import json
+import threading
+import time
+from batching import MicroBatcher, Request
+
+class StubBackend:
+    def __init__(self, call_ms, segment_ms, parallel):
+        self.call = call_ms / 1000.0
+        self.segment = segment_ms / 1000.0
+        self.slots = threading.Semaphore(parallel)
+        self.calls = 0
+
+    def _run(self, segments):
+        with self.slots:
+            self.calls += 1
+            time.sleep(self.call + self.segment * segments)
+
+    def translate(self, text, target_language, references=(), source_language='', dialect=''):
+        self._run(1)
+        return text[::-1]
+
+    def translate_batch(self, texts, target_language, source_language='', dialect=''):
+        self._run(len(texts))
+        return [text[::-1] for text in texts]
+
+def run(batch_size, mode, args):
+    backend = StubBackend(args.call_ms, args.segment_ms, args.parallel)
+    batcher = MicroBatcher(backend, max_batch_size=batch_size, max_wait_ms=0, mode=mode)
+    languages = args.languages.split(',')
+
+    for i in range(args.requests):
+        batcher.add(Request(f'message {i}', languages[i % len(languages)], 'reply', str(i), i))
+
+    start = time.perf_counter()
+    while batcher.pending:
+        batcher.process(batcher.take())
+    elapsed = time.perf_counter() - start
+    batcher.shutdown()
+
+    return {
+        'mode': mode,
+        'batch_size': batch_size,
+        'requests': args.requests,
+        'backend_calls': backend.calls,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(args.requests / elapsed, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=256)
+    parser.add_argument('--batch-sizes', default='1,2,4,8,16,32')
+    parser.add_argument('--modes', default='concurrent,prompt')
+    parser.add_argument('--call-ms', type=float, default=40)
+    parser.add_argument('--segment-ms', type=float, default=10)
+    parser.add_argument('--parallel', type=int, default=4)
+    parser.add_argument('--languages', default='es,fr')
+    parser.add_argument('--json', action='store_true', help='print one JSON object per result')
+    args = parser.parse_args()
+
+    if not args.json:
+        print(f"{'mode':<12}{'batch':>6}{'calls':>8}{'seconds':>10}{'req/s':>10}")
+    for mode in args.modes.split(','):
+        for batch_size in (int(size) for size in args.batch_sizes.split(',')):
+            result = run(batch_size, mode, args)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(f"{mode:<12}{batch_size:>6}{result['backend_calls']:>8}"
+                      f"{result['seconds']:>10}{result['throughput_rps']:>10}")
+
+if __name__ == '__main__':
+    main()
@@ -1,43 +1,356 @@
 import pika
-import json
 import os
-from ollama import Client
+import time
+import functools
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import wire
+from backends import BackendPool
+from batching import MicroBatcher, Request, RequestGroup
 
 # RabbitMQ connection parameters
 rabbitmq_host = os.environ.get('RABBITMQ_HOST', 'localhost')
 
-connection = pika.BlockingConnection(pika.ConnectionParameters(host=rabbitmq_host))
-channel = connection.channel()
-channel.queue_declare(queue='llm_queue')
-
-def on_request(ch, method, props, body):
-    message = json.loads(body.decode())
-    input_text = message.get('text', '')
-    target_language = message.get('target_language', 'en')
-
-    # Process input with Llama3 using Ollama Client
-    client = Client(host='http://localhost:11434')
-    response = client.chat(model='dolphin-llama3', messages=[
-        {
-            'role': 'user',
-            'content': 'translate this to ' + 'Mexican Spanish' + ': ' + input_text,
-        },
-    ])
-
-    # Extract the response content
-    response_content = response['choices'][0]['message']['content']
-
-    # Send response back
-    ch.basic_publish(
+# Model backends: comma-separated model servers, picked by fewest outstanding requests
+ollama_hosts = os.environ.get('OLLAMA_HOSTS', os.environ.get('OLLAMA_HOST', 'http://localhost:11434')).split(',')
+llm_model = os.environ.get('LLM_MODEL', 'dolphin-llama3')
+backend_max_failures = int(os.environ.get('LLM_BACKEND_MAX_FAILURES', 3))
+backend_eject_seconds = float(os.environ.get('LLM_BACKEND_EJECT_SECONDS', 30))
+
+# Request queues, keep in sync with flask_api/translation_service.py. Interactive
+# messages are published with a higher priority than bulk/backfill work.
+request_queue = 'llm_requests'
+request_queue_arguments = {'x-max-priority': 10}
+# Languages this worker has warm models/prompts for; each gets its own llm_requests.<language> queue
+pinned_languages = [l.strip() for l in os.environ.get('LLM_LANGUAGES', '').split(',') if l.strip()]
+# Pinned workers can also take unpinned languages from the shared queue
+consume_shared_queue = os.environ.get('LLM_CONSUME_SHARED', 'true' if not pinned_languages else 'false').lower() == 'true'
+# Queue used before the rename to llm_requests (no priority argument, so it can't be
+# redeclared under the new name); still served with the shared queue until every
+# sender is upgraded. Set LLM_LEGACY_QUEUE='' to stop consuming it.
+legacy_request_queue = os.environ.get('LLM_LEGACY_QUEUE', 'llm_queue')
+
+# Micro-batching: flush after this many messages or after the oldest has waited this long
+max_batch_size = int(os.environ.get('LLM_MAX_BATCH_SIZE', 8))
+max_batch_wait_ms = float(os.environ.get('LLM_MAX_BATCH_WAIT_MS', 20))
+batch_mode = os.environ.get('LLM_BATCH_MODE', 'concurrent')
+
+# Streaming: partial output is coalesced and sent at most this often (the first chunk goes out immediately)
+stream_flush_ms = float(os.environ.get('LLM_STREAM_FLUSH_MS', 50))
+
+# A request redelivered because a worker died or lost its connection before acking it
+# is counted in a 'deliveries' header; past this many it goes to the dead-letter queue
+max_deliveries = int(os.environ.get('LLM_MAX_DELIVERIES', 3))
+dead_letter_queue = f'{request_queue}.dead'
+# Replies to recently finished requests, by idempotency key, so a redelivered
+# or retried request is answered again without another model call
+recent_responses_size = int(os.environ.get('LLM_RECENT_RESPONSES', 1000))
+
+# Replies use the format of their request (JSON when it has no content_type) and
+# compress above wire_compress_min bytes when the requester accepts it
+wire_compression = os.environ.get('LLM_WIRE_COMPRESSION', 'zstd')
+wire_compress_min = int(os.environ.get('LLM_WIRE_COMPRESS_MIN', 1024))
+codec = wire.Codec(wire.MSGPACK, wire_compression, wire_compress_min)
+
+class RecentResponses:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        # OrderedDict reordering is not thread-safe; callers may be worker threads
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        if not self.maxsize or key is None:
+            return
+        with self.lock:
+            self.entries[key] = body
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+recent_responses = RecentResponses(recent_responses_size)
+
+def idempotency_key(trace_id, body):
+    # flask_api keeps a message's trace_id across retries of its translation job,
+    # so a retry of a request that already finished here carries the same key
+    return hashlib.sha256(trace_id.encode() + b'\0' + body).hexdigest()
+
+def request_format(props):
+    headers = props.headers or {}
+    return props.content_type or wire.JSON, headers.get('accept_encoding', '')
+
+def publish_reply(channel, routing_key, correlation_id, trace_id, reply_format, payload):
+    body, content_type, content_encoding = codec.encode(payload, *reply_format)
+    channel.basic_publish(
         exchange='',
-        routing_key=props.reply_to,
-        properties=pika.BasicProperties(correlation_id=props.correlation_id),
-        body=json.dumps({'response': response_content})
+        routing_key=routing_key,
+        properties=pika.BasicProperties(
+            correlation_id=correlation_id, content_type=content_type, content_encoding=content_encoding,
+            headers={'trace_id': trace_id, 'wire': wire.VERSION}
+        ),
+        body=body
     )
-    ch.basic_ack(delivery_tag=method.delivery_tag)
 
-channel.basic_qos(prefetch_count=1)
-channel.basic_consume(queue='llm_queue', on_message_callback=on_request)
+def finished(kind, item, failed):
+    elapsed = time.monotonic() - item.received
+    metrics.observe('request', elapsed)
+    metrics.REQUESTS.labels(kind, 'error' if failed else 'ok').inc()
+    metrics.IN_FLIGHT.labels(kind).dec()
+    logging.debug(f"trace {item.trace_id}: {kind} request {'failed' if failed else 'done'} in {elapsed:.3f}s")
+
+def reply(channel, request, seq=None):
+    if request.error is not None:
+        body = {'error': request.error}
+    else:
+        body = {'response': request.response}
+    if seq is not None:
+        body.update({'seq': seq, 'final': True})
+    if request.error is None:
+        recent_responses.set(request.key, {'response': request.response})
+
+    publish_reply(channel, request.reply_to, request.correlation_id, request.trace_id, request.reply_format, body)
+    channel.basic_ack(delivery_tag=request.delivery_tag)
+    finished('stream' if seq is not None else 'single', request, request.error is not None)
+
+def reply_group(channel, group):
+    group.replied = True
+    body = {
+        'responses': [request.response for request in group.requests],
+        'errors': [request.error for request in group.requests]
+    }
+    if not any(body['errors']):
+        recent_responses.set(group.key, body)
+    publish_reply(channel, group.reply_to, group.correlation_id, group.trace_id, group.reply_format, body)
+    channel.basic_ack(delivery_tag=group.delivery_tag)
+    finished('group', group, any(request.error is not None for request in group.requests))
+
+def publish_chunk(channel, request, seq, chunk):
+    publish_reply(
+        channel, request.reply_to, request.correlation_id, request.trace_id, request.reply_format,
+        {'chunk': chunk, 'seq': seq}
+    )
+
+def stream_translation(connection, channel, backend, request):
+    # Runs on a worker thread; pika channels may only be used from the
+    # connection's thread, so every publish is handed back via add_callback_threadsafe.
+    seq = 0
+    parts = []
+    buffered = []
+    last_flush = None
+    started = time.monotonic()
+    try:
+        for token in backend.stream(request.text, request.target_language, request.references,
+                                    request.source_language, request.dialect):
+            if not token:
+                continue
+            parts.append(token)
+            buffered.append(token)
+            now = time.monotonic()
+            if last_flush is None:
+                metrics.observe('first_token', now - started)
+            if last_flush is None or (now - last_flush) * 1000 >= stream_flush_ms:
+                connection.add_callback_threadsafe(
+                    functools.partial(publish_chunk, channel, request, seq, ''.join(buffered))
+                )
+                seq += 1
+                buffered = []
+                last_flush = now
+        if buffered:
+            connection.add_callback_threadsafe(
+                functools.partial(publish_chunk, channel, request, seq, ''.join(buffered))
+            )
+            seq += 1
+        request.response = ''.join(parts)
+    except Exception as error:
+        request.error = str(error)
+    metrics.observe('model', time.monotonic() - started)
+    connection.add_callback_threadsafe(functools.partial(reply, channel, request, seq))
+
+def run_batch(batcher, batch):
+    now = time.monotonic()
+    for request in batch:
+        metrics.observe('batch_wait', now - request.received)
+    metrics.BATCH_SIZE.observe(len(batch))
+    metrics.BATCHES.labels(batcher.mode).inc()
+    batcher.process(batch)
+    metrics.observe('model', time.monotonic() - now)
+    return batch
+
+def request_headers(props):
+    # trace_id and sent_at are set by flask_api's TranslationServiceClient
+    headers = props.headers or {}
+    sent_at = headers.get('sent_at')
+    if sent_at is not None:
+        metrics.observe('queue_wait', max(0.0, time.time() - sent_at))
+    return headers.get('trace_id')
+
+def redeliver(channel, method, props, body, trace_id):
+    # Puts a redelivered request back with its delivery count, or dead-letters
+    # it and fails the caller once it has been delivered max_deliveries times.
+    # Republishing keeps the count in the message, where a crash cannot lose it.
+    headers = dict(props.headers or {})
+    headers['deliveries'] = headers.get('deliveries', 1) + 1
+    if headers['deliveries'] > max_deliveries:
+        logging.error(f"trace {trace_id}: dead-lettering request after {max_deliveries} deliveries")
+        channel.basic_publish(
+            exchange='',
+            routing_key=dead_letter_queue,
+            properties=pika.BasicProperties(
+                correlation_id=props.correlation_id, reply_to=props.reply_to, content_type=props.content_type,
+                content_encoding=props.content_encoding, headers=headers, delivery_mode=2
+            ),
+            body=body
+        )
+        publish_reply(
+            channel, props.reply_to, props.correlation_id, trace_id, request_format(props),
+            {'error': f'Request dead-lettered after {max_deliveries} deliveries'}
+        )
+        metrics.REQUESTS.labels('redelivered', 'dead_lettered').inc()
+    else:
+        channel.basic_publish(
+            exchange='',
+            routing_key=method.routing_key,
+            properties=pika.BasicProperties(
+                correlation_id=props.correlation_id, reply_to=props.reply_to, priority=props.priority,
+                expiration=props.expiration, content_type=props.content_type,
+                content_encoding=props.content_encoding, headers=headers
+            ),
+            body=body
+        )
+        metrics.REQUESTS.labels('redelivered', 'requeued').inc()
+    channel.basic_ack(delivery_tag=method.delivery_tag)
+
+def replay(channel, method, props, message, response, trace_id):
+    # Answers a request that already finished here from recent_responses
+    if message.get('stream'):
+        response = dict(response, seq=0, final=True)
+    publish_reply(channel, props.reply_to, props.correlation_id, trace_id, request_format(props), response)
+    channel.basic_ack(delivery_tag=method.delivery_tag)
+    metrics.REQUESTS.labels('group' if 'texts' in message else 'single', 'replayed').inc()
+    logging.debug(f"trace {trace_id}: answered from recent responses")
+
+def main():
+    # One persistent client per model server for the lifetime of the worker
+    backend = BackendPool.from_hosts(
+        [host.strip() for host in ollama_hosts if host.strip()],
+        llm_model,
+        max_failures=backend_max_failures,
+        eject_seconds=backend_eject_seconds
+    )
+    batcher = MicroBatcher(backend, max_batch_size, max_batch_wait_ms, batch_mode)
+    # Model calls run here so the connection keeps servicing heartbeats meanwhile
+    runner = ThreadPoolExecutor(max_workers=1)
+    # Streaming requests skip batching, time-to-first-token matters more than throughput
+    streamer = ThreadPoolExecutor(max_workers=max_batch_size)
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=rabbitmq_host))
+    channel = connection.channel()
+    queues = [f'{request_queue}.{language}' for language in pinned_languages]
+    if consume_shared_queue:
+        queues.append(request_queue)
+    for queue in queues:
+        channel.queue_declare(queue=queue, arguments=request_queue_arguments)
+    if consume_shared_queue and legacy_request_queue:
+        channel.queue_declare(queue=legacy_request_queue)
+        queues.append(legacy_request_queue)
+    channel.queue_declare(queue=dead_letter_queue, durable=True)
+
+    def on_request(ch, method, props, body):
+        trace_id = request_headers(props) or props.correlation_id
+        if method.redelivered:
+            redeliver(ch, method, props, body, trace_id)
+            return
+        try:
+            message = codec.decode(body, props.content_type, props.content_encoding, (props.headers or {}).get('wire'))
+        except Exception as error:
+            logging.error(f"trace {trace_id}: undecodable request: {error}")
+            publish_reply(ch, props.reply_to, props.correlation_id, trace_id, (wire.JSON, ''), {'error': 'Undecodable request'})
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return
+        key = idempotency_key(trace_id, body)
+        response = recent_responses.get(key)
+        if response is not None:
+            replay(ch, method, props, message, response, trace_id)
+            return
+
+        if 'texts' in message:
+            group = RequestGroup(
+                texts=message['texts'],
+                target_language=message.get('target_language', 'en'),
+                reply_to=props.reply_to,
+                correlation_id=props.correlation_id,
+                delivery_tag=method.delivery_tag,
+                priority=props.priority or 0,
+                trace_id=trace_id,
+                source_language=message.get('source_language', ''),
+                dialect=message.get('dialect', '')
+            )
+            group.key = key
+            group.reply_format = request_format(props)
+            metrics.IN_FLIGHT.labels('group').inc()
+            if not group.requests:
+                reply_group(ch, group)
+            for request in group.requests:
+                batcher.add(request)
+            return
+
+        request = Request(
+            text=message.get('text', ''),
+            target_language=message.get('target_language', 'en'),
+            reply_to=props.reply_to,
+            correlation_id=props.correlation_id,
+            delivery_tag=method.delivery_tag,
+            priority=props.priority or 0,
+            trace_id=trace_id,
+            references=message.get('references') or (),
+            source_language=message.get('source_language', ''),
+            dialect=message.get('dialect', '')
+        )
+        request.key = key
+        request.reply_format = request_format(props)
+        if message.get('stream'):
+            metrics.IN_FLIGHT.labels('stream').inc()
+            streamer.submit(stream_translation, connection, ch, backend, request)
+        else:
+            metrics.IN_FLIGHT.labels('single').inc()
+            batcher.add(request)
+
+    channel.basic_qos(prefetch_count=max_batch_size)
+    for queue in queues:
+        channel.basic_consume(queue=queue, on_message_callback=on_request)
+
+    print(f" [x] Awaiting RPC requests on {', '.join(queues)}")
+    in_progress = None
+    while True:
+        if in_progress is not None:
+            connection.process_data_events(time_limit=0.01)
+            metrics.PENDING.set(len(batcher.pending))
+            if in_progress.done():
+                for request in in_progress.result():
+                    if request.group is None:
+                        reply(channel, request)
+                    elif request.group.done and not request.group.replied:
+                        reply_group(channel, request.group)
+                in_progress = None
+            continue
+
+        connection.process_data_events(time_limit=batcher.time_until_due())
+        metrics.PENDING.set(len(batcher.pending))
+        if batcher.ready():
+            in_progress = runner.submit(run_batch, batcher, batcher.take())
 
-print(" [x] Awaiting RPC requests")
-channel.start_consuming()
\ No newline at end of file
+if __name__ == '__main__':
+    metrics.Profiler(metrics.profile_dir, 'llm_service').install_signal()
+    metrics.serve()
+    main()
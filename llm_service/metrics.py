@@ -0,0 +1,94 @@
+import cProfile
+import logging
+import os
+import signal
+import time
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, start_http_server
+from prometheus_client import multiprocess
+
+# Worker processes started by supervisor.py share PROMETHEUS_MULTIPROC_DIR and
+# the supervisor serves their combined samples; a single process serves its own.
+metrics_port = int(os.environ.get('LLM_METRICS_PORT', 9100))
+profile_dir = os.environ.get('LLM_PROFILE_DIR', '/tmp/llm_service_profiles')
+
+BUCKETS = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    'llm_service_stage_seconds', 'Time spent in each stage of a translation request', ['stage'], buckets=BUCKETS
+)
+BACKEND_SECONDS = Histogram(
+    'llm_service_backend_seconds', 'Model server call latency', ['host', 'method'], buckets=BUCKETS
+)
+BATCH_SIZE = Histogram(
+    'llm_service_batch_size', 'Requests per micro-batch', buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+REQUESTS = Counter('llm_service_requests', 'Translation requests handled', ['kind', 'outcome'])
+BATCHES = Counter('llm_service_batches', 'Micro-batches processed', ['mode'])
+BACKEND_EJECTIONS = Counter('llm_service_backend_ejections', 'Model servers ejected after failures', ['host'])
+PENDING = Gauge(
+    'llm_service_batch_pending', 'Requests waiting in the micro-batcher', multiprocess_mode='livesum'
+)
+IN_FLIGHT = Gauge(
+    'llm_service_in_flight', 'Requests being translated', ['kind'], multiprocess_mode='livesum'
+)
+BACKEND_OUTSTANDING = Gauge(
+    'llm_service_backend_outstanding', 'Calls in progress per model server', ['host'], multiprocess_mode='livesum'
+)
+
+def observe(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+def serve(port=None):
+    port = metrics_port if port is None else port
+    if not port:
+        return
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    start_http_server(port, registry=registry)
+    logging.info(f"Serving metrics on :{port}/metrics")
+
+def worker_exited(pid):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid)
+
+class Profiler:
+    # Keep in sync with flask_api/timing.py. kill -USR2 <pid> starts cProfile
+    # on the main thread, the next USR2 writes a .prof file to LLM_PROFILE_DIR;
+    # nothing is hooked while it is off.
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.profile = None
+
+    @property
+    def running(self):
+        return self.profile is not None
+
+    def start(self):
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            logging.info(f"Profiling {self.name} (pid {os.getpid()})")
+
+    def stop(self):
+        if self.profile is None:
+            return None
+        profile, self.profile = self.profile, None
+        profile.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{self.name}-{os.getpid()}-{int(time.time())}.prof')
+        profile.dump_stats(path)
+        logging.info(f"Wrote profile to {path}")
+        return path
+
+    def toggle(self, *_):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def install_signal(self, signum=signal.SIGUSR2):
+        signal.signal(signum, self.toggle)
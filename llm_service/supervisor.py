@@ -0,0 +1,70 @@
+import logging
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+
+# Number of independent consumers; each has its own RabbitMQ connection and backend pool
+worker_count = int(os.environ.get('LLM_WORKERS', multiprocessing.cpu_count()))
+# 'process' sidesteps the GIL for prompt building and JSON work; 'thread' is lighter
+worker_mode = os.environ.get('LLM_WORKER_MODE', 'process')
+restart_delay = float(os.environ.get('LLM_WORKER_RESTART_DELAY', 5))
+
+if worker_mode == 'process' and 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+    # Worker processes write their samples here and the supervisor serves the
+    # combined view; must be set before prometheus_client is first imported
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='llm_service_metrics_')
+
+import llm_service
+import metrics
+
+def run_worker(index):
+    if worker_mode == 'process':
+        # Forked children inherit the supervisor's handler; terminate() must still work
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        # kill -USR2 <worker pid> profiles that worker's consumer loop
+        metrics.Profiler(metrics.profile_dir, f'llm_service-{index}').install_signal()
+    try:
+        llm_service.main()
+    except KeyboardInterrupt:
+        pass
+
+def start_worker(index):
+    if worker_mode == 'thread':
+        worker = threading.Thread(target=run_worker, args=(index,), name=f'llm-worker-{index}', daemon=True)
+    else:
+        worker = multiprocessing.Process(target=run_worker, args=(index,), name=f'llm-worker-{index}')
+    worker.start()
+    return worker
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    if worker_mode not in ('process', 'thread'):
+        raise ValueError(f"Unknown LLM_WORKER_MODE: {worker_mode}")
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    metrics.serve()
+
+    workers = {index: start_worker(index) for index in range(worker_count)}
+    logging.info(f"Started {worker_count} llm_service {worker_mode} workers")
+
+    while not stopping.wait(restart_delay):
+        for index, worker in list(workers.items()):
+            if not worker.is_alive():
+                logging.warning(f"{worker.name} exited, restarting it")
+                if isinstance(worker, multiprocessing.Process):
+                    metrics.worker_exited(worker.pid)
+                workers[index] = start_worker(index)
+
+    for worker in workers.values():
+        if isinstance(worker, multiprocessing.Process):
+            worker.terminate()
+    for worker in workers.values():
+        if isinstance(worker, multiprocessing.Process):
+            worker.join(timeout=10)
+
+if __name__ == '__main__':
+    main()